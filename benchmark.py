@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark disasm.py on reproducible synthetic ROMs, the Game Boy Color BIOS, and real
+ROM files.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+
+import disasm
+
+
+SIZES = [0x8000, 0x100000, 0x800000]
+KINDS = ['code', 'data', 'branches', 'labels']
+
+# the Game Boy Color BIOS, rebuilt from the bytes in the comments of its listing
+BIOS_LISTING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gbc_bios.asm')
+# '; 0000: 31 fe ff', '; 00f4', '; 0008-000f' or '; 0100-01ff: 00'
+BIOS_COMMENT = re.compile(r'([0-9a-f]{4})(?:-([0-9a-f]{4}))?(?:: ([0-9a-f ]+))?$')
+
+# opcodes that neither branch nor are invalid, so generated code runs straight through
+PLAIN_OPCODES = [opcode for opcode in range(0x100) if not disasm.opcode_flows[opcode]
+	and not disasm.opcode_table[opcode][1].startswith('db ')
+	and opcode not in {0x10, 0x76, 0xcb}]
+
+
+def cpu_address(address):
+	return disasm.address_to_offset(address)
+
+def generate_rom(kind, size, seed=0):
+	# a ROM with the given kind of content, and the lines of its sym file
+	rng = random.Random('%s %d %d' % (kind, size, seed))
+	rom = bytearray(rng.randbytes(size))
+	branch_rate = 0.5 if kind == 'branches' else 0.15
+	# fraction of each bank that is code rather than data
+	code_share = 0.1 if kind == 'data' else 0.8
+	num_banks = max(size // disasm.BANK_SIZE, 1)
+
+	functions = []
+	for bank in range(num_banks):
+		start = 0x150 if bank == 0 else bank * disasm.BANK_SIZE
+		end = min((bank + 1) * disasm.BANK_SIZE, size) - 0x100
+		bank_functions = []
+		pc = start
+		while pc < start + (end - start) * code_share:
+			bank_functions.append(pc)
+			pc += rng.randrange(0x20, 0x100)
+		functions.append(bank_functions)
+
+	for bank, bank_functions in enumerate(functions):
+		for start, end in zip(bank_functions, bank_functions[1:] + [None]):
+			pc = start
+			stop = (end or pc + 0x20) - 4
+			while pc < stop:
+				if rng.random() < branch_rate:
+					callees = functions[rng.choice([0, bank])] or functions[0]
+					target = cpu_address(rng.choice(callees))
+					opcode = rng.choice([0xc4, 0xcc, 0xcd, 0xc2, 0xca])
+					rom[pc:pc + 3] = bytes([opcode, target & 0xff, target >> 8])
+					pc += 3
+				else:
+					opcode = rng.choice(PLAIN_OPCODES)
+					width = disasm.opcode_widths[opcode]
+					rom[pc] = opcode
+					rom[pc + 1:pc + 1 + width] = rng.randbytes(width)
+					pc += 1 + width
+			rom[pc] = 0xc9
+
+	if functions[0]:
+		entry = functions[0][0]
+		rom[0:3] = bytes([0xc3, entry & 0xff, entry >> 8])
+
+	sym_lines = []
+	for bank, bank_functions in enumerate(functions):
+		for index, address in enumerate(bank_functions):
+			if kind == 'labels' or index % 4 == 0:
+				sym_lines.append('%02x:%04x Function_%d_%d' % (bank, cpu_address(address),
+					bank, index))
+			if kind == 'labels':
+				# local labels inside the function
+				for offset in range(0x10, 0x20, 4):
+					sym_lines.append('%02x:%04x Function_%d_%d.local_%x' % (bank,
+						cpu_address(address + offset), bank, index, offset))
+	return bytes(rom), sym_lines
+
+
+def bios_rom(filename=BIOS_LISTING):
+	# the BIOS and the lines of a sym file with the labels of its listing
+	rom = bytearray()
+	sym_lines = []
+	# labels waiting for the address of the next line with bytes, and the last global one
+	labels = []
+	scope = None
+	with open(filename, 'r') as f:
+		for line in f:
+			code, _, comment = line.partition(';')
+			code = code.strip()
+			if code.endswith(':'):
+				name = code[:-1]
+				if not name.startswith('.'):
+					scope = name
+				labels.append(scope + name if name.startswith('.') else name)
+				continue
+			match = BIOS_COMMENT.match(comment.strip())
+			if not code or not match:
+				continue
+			start, end, data = match.groups()
+			start = int(start, 16)
+			end = int(end, 16) + 1 if end else None
+			if data:
+				data = bytes.fromhex(data)
+				# a run of the same byte, e.g. from rept
+				if end and len(data) == 1:
+					data *= end - start
+			elif code.startswith('db '):
+				data = bytes(int(value.strip().lstrip('$'), 16)
+					for value in code[3:].split(','))
+			elif code == 'nop':
+				data = b'\0'
+			else:
+				raise ValueError('%s: no bytes for %r' % (filename, line.strip()))
+			if len(rom) != start or (end and start + len(data) != end):
+				raise ValueError('%s: bytes out of order at %04x' % (filename, start))
+			rom += data
+			sym_lines.extend('00:%04x %s' % (start, name) for name in labels)
+			labels = []
+	return bytes(rom), sym_lines
+
+
+def write_case(directory, name, rom, sym_lines):
+	bin_filename = os.path.join(directory, name + '.bin')
+	sym_filename = os.path.join(directory, name + '.sym')
+	with open(bin_filename, 'wb') as f:
+		f.write(rom)
+	with open(sym_filename, 'w') as f:
+		f.write('\n'.join(sym_lines) + '\n')
+	return bin_filename, sym_filename
+
+
+def peak_rss():
+	import resource
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# kilobytes on Linux, bytes on macOS
+	return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_case(bin_filename, sym_filename=None, entry_point=0x000000):
+	result = {}
+
+	start = time.perf_counter()
+	if sym_filename:
+		labels, ram_labels = disasm.parse_symfile(sym_filename)
+	result['parse_symfile_time'] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	disassembler = disasm.Disassembler(bin_filename)
+	if sym_filename:
+		disassembler.add_labels(labels, ram_labels)
+	disassembler.labels[entry_point].add('ENTRY_POINT')
+	result['load_time'] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	disassembler.trace(entry_point)
+	result['trace_time'] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	with open(os.devnull, 'w') as f:
+		disassembler.write(f)
+	result['render_time'] = time.perf_counter() - start
+
+	result['rom_size'] = disassembler.data_size
+	result['labels'] = len(disassembler.labels)
+	result['instructions'] = disassembler.num_instructions()
+	result['instructions_per_second'] = result['instructions'] / max(result['trace_time'], 1e-9)
+	result['peak_rss'] = peak_rss()
+	return result
+
+
+def run_isolated(bin_filename, sym_filename=None, entry_point=0x000000):
+	# a fresh interpreter per case, so that peak RSS belongs to that case alone
+	command = [sys.executable, os.path.abspath(__file__), '--run-case', bin_filename,
+		'--entry-point', '%x' % entry_point]
+	if sym_filename:
+		command += ['--sym', sym_filename]
+	output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+	return json.loads(output)
+
+
+def best_of(repeat, function):
+	# the fastest run of each timing, and the largest peak RSS
+	results = [function() for _ in range(repeat)]
+	best = dict(results[0])
+	for result in results[1:]:
+		for key, value in result.items():
+			if key.endswith('_time'):
+				best[key] = min(best[key], value)
+		best['peak_rss'] = max(best['peak_rss'], result['peak_rss'])
+	best['instructions_per_second'] = best['instructions'] / max(best['trace_time'], 1e-9)
+	return best
+
+
+def format_size(size):
+	for unit in ['B', 'KB', 'MB']:
+		if size < 1024 or unit == 'MB':
+			return '%d %s' % (size, unit) if unit == 'B' else '%.4g %s' % (size, unit)
+		size /= 1024
+
+def print_results(results, baseline=None):
+	print('%-16s %9s %9s %9s %9s %12s %10s' % ('case', 'symfile', 'trace', 'render',
+		'peak RSS', 'instr/s', 'vs base'))
+	for name, result in results.items():
+		change = ''
+		if baseline and name in baseline:
+			old = baseline[name]
+			change = '%.2fx' % ((old['trace_time'] + old['render_time']) /
+				max(result['trace_time'] + result['render_time'], 1e-9))
+		print('%-16s %8.3fs %8.3fs %8.3fs %9s %12.0f %10s' % (name,
+			result['parse_symfile_time'], result['trace_time'], result['render_time'],
+			format_size(result['peak_rss']), result['instructions_per_second'], change))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip())
+	parser.add_argument('roms', nargs='*', metavar='a.bin[:a.sym]',
+		help='real ROMs to benchmark as well as the built-in Game Boy Color BIOS')
+	parser.add_argument('-s', '--sizes', type=lambda s: [int(x, 0) for x in s.split(',')],
+		default=SIZES, help='comma-separated synthetic ROM sizes in bytes (default %s)' %
+			','.join('0x%x' % size for size in SIZES))
+	parser.add_argument('-k', '--kinds', type=lambda s: s.split(','), default=KINDS,
+		help='comma-separated synthetic ROM kinds (default %s)' % ','.join(KINDS))
+	parser.add_argument('-r', '--repeat', type=int, default=3,
+		help='report the best of this many runs')
+	parser.add_argument('-o', '--output', metavar='results.json',
+		help='save the results as JSON')
+	parser.add_argument('-c', '--compare', metavar='baseline.json',
+		help='compare against results saved by an earlier version')
+	parser.add_argument('--run-case', metavar='a.bin', help=argparse.SUPPRESS)
+	parser.add_argument('--sym', help=argparse.SUPPRESS)
+	parser.add_argument('--entry-point', type=lambda s: int(s, 16), default=0,
+		help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.run_case:
+		json.dump(run_case(args.run_case, args.sym, args.entry_point), sys.stdout)
+		return
+
+	results = {}
+	with tempfile.TemporaryDirectory() as tmpdir:
+		for kind in args.kinds:
+			if kind not in KINDS:
+				parser.error('unknown kind: %s' % kind)
+			for size in args.sizes:
+				name = '%s-%s' % (kind, format_size(size).replace(' ', ''))
+				bin_filename, sym_filename = write_case(tmpdir, name,
+					*generate_rom(kind, size))
+				results[name] = best_of(args.repeat,
+					lambda: run_isolated(bin_filename, sym_filename))
+				print('.', end='', file=sys.stderr, flush=True)
+
+		bin_filename, sym_filename = write_case(tmpdir, 'gbc-bios', *bios_rom())
+		results['gbc-bios'] = best_of(args.repeat,
+			lambda: run_isolated(bin_filename, sym_filename))
+		print('.', end='', file=sys.stderr, flush=True)
+
+		for rom in args.roms:
+			bin_filename, _, sym_filename = rom.partition(':')
+			name = os.path.basename(bin_filename)
+			results[name] = best_of(args.repeat,
+				lambda: run_isolated(bin_filename, sym_filename or None))
+			print('.', end='', file=sys.stderr, flush=True)
+	print(file=sys.stderr)
+
+	baseline = None
+	if args.compare:
+		with open(args.compare, 'r') as f:
+			baseline = json.load(f)['results']
+	print_results(results, baseline)
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({
+				'version': disasm.__version__,
+				'python': platform.python_version(),
+				'platform': platform.platform(),
+				'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+				'results': results,
+			}, f, indent='\t')
+
+if __name__ == '__main__':
+	main()
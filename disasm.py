@@ -9,16 +9,94 @@ __version__ = '1.8.1'
 
 import sys
 import os.path
-from collections import defaultdict
+import mmap
+import json
+import time
+import zlib
+import struct
+import hashlib
+import re
+import argparse
+import tempfile
+import difflib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque, OrderedDict
+from contextlib import contextmanager
+from stat import S_ISSOCK
+from itertools import accumulate, compress, islice, zip_longest
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
-starting_points = set()
-labels = defaultdict(lambda: set())
-raw_data = {}
-left_data = {}
-data_size = 0
-operations = {}
-terminate = False
+BANK_SIZE = 0x4000
+
+LINE_LENGTH = 50
+CHUNK_SIZE = 8 # data bytes per line
+DATA_BLOCK_SIZE = CHUNK_SIZE * 8192 # data bytes formatted at once
+
+WRITE_BUFFER_SIZE = 1 << 20
+WRITE_BATCH_LINES = 4096
+# ROM bytes rendered by each task of a parallel render
+RENDER_CHUNK_SIZE = BANK_SIZE * 4
+
+CACHE_MAGIC = b'GBDA'
+CACHE_VERSION = 2
+# magic, version, ROM size, ROM labels size, RAM labels size
+CACHE_HEADER = struct.Struct('<4sHIII')
+
+INCREMENTAL_MAGIC = b'GBDI'
+CHECKSUM_BLOCK_SIZE = 0x100
+# magic, version, analysis key, analysis size, checksum blocks, regions
+INCREMENTAL_HEADER = struct.Struct('<4sH20sIII')
+UINT32_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+# an instruction in lengths with another one beginning inside it
+OVERLAP_PATTERN = re.compile(rb'(?=[\x02\x03][\x01-\x03]|\x03[\x00-\xff][\x01-\x03])')
+
+WINDOW_MAGIC = b'GBDW'
+# magic, version, ROM size, ROM label addresses, RAM label addresses
+WINDOW_HEADER = struct.Struct('<4sH2xIII')
+
+BANK_MAGIC = b'GBDB'
+# magic, version, bank size, branch targets
+BANK_HEADER = struct.Struct('<4sH2xII')
+
+ROM_EXTENSIONS = ('.bin', '.gb', '.gbc')
+# batch workers are replaced after this many ROMs, returning their memory
+BATCH_TASKS_PER_CHILD = 16
+
+# pointer tables that the code loads are at least this many words in a row that could
+# point at routines, and tables that nothing loads at least this many
+TABLE_MIN_ENTRIES = 3
+TABLE_MIN_UNLOADED_ENTRIES = 8
+TABLE_PATTERN = re.compile(rb'[\x01\x02]{%d,}' % TABLE_MIN_ENTRIES)
+# rounds of finding pointer tables and tracing what they point at
+TABLE_PASSES = 8
+# pointers below this are more likely to be counts or padding than code
+TABLE_MIN_POINTER = 0x100
+# instructions decoded from each target to see whether it looks like a routine
+TABLE_MAX_INSTRUCTIONS = 64
+
+# signatures are indexed by this many bytes in a row without wildcards, read as a uint32
+SIGNATURE_GRAM_SIZE = 4
+
+# kinds of control flow graph edges: a jump, a call, or the next instruction after a
+# conditional branch, a call or a block that ends where a label begins
+EDGE_KINDS = ['jump', 'call', 'next']
+EDGE_JUMP, EDGE_CALL, EDGE_NEXT = range(len(EDGE_KINDS))
+EDGE_DOT_ATTRIBUTES = ['', ' [color=blue]', ' [style=dashed]']
+
+# how far after a label an address can be written relative to it
+NEAREST_LABEL_DISTANCE = 0x100
+
+OUTPUT_FORMATS = {'asm': '.asm', 'jsonl': '.jsonl', 'binary': '.rec'}
+RECORD_TYPES = ['instruction', 'data', 'label']
+# size of the rest, type, address, target, bytes, mnemonic and operands, labels
+RECORD_HEADER = struct.Struct('<IBIiHBH')
+RECORD_STRING_SIZE = struct.Struct('<H')
+
+SERVER_MAX_ROMS = 8
+SERVER_ENVIRONMENT_VARIABLE = 'DISASM_SERVER'
 
 
 def signed(b):
@@ -38,6 +116,25 @@ def u16le(lo, hi):
 def create_db(pc, *args):
 	return 'db ' + ', '.join(u8(b) for b in args)
 
+def format_data(data, address):
+	# yield the 'db' lines for a run of data, formatted a whole block at a time
+	stride = CHUNK_SIZE * 5
+	dbs_length = 3 + stride - 2
+	template = '\tdb %%s%s; %%06x-%%06x' % (' ' * max(LINE_LENGTH - dbs_length, 1))
+	for start in range(0, len(data), DATA_BLOCK_SIZE):
+		block = data[start:start + DATA_BLOCK_SIZE]
+		# each byte becomes the five characters '$xx, '
+		text = '$' + block.hex(',').replace(',', ', $')
+		size = len(block) - len(block) % CHUNK_SIZE
+		pc = address + start
+		yield from [template % (text[i:i + stride - 2], a, a + CHUNK_SIZE - 1)
+			for i, a in zip(range(0, size * 5, stride), range(pc, pc + size, CHUNK_SIZE))]
+		if size < len(block):
+			dbs = create_db(pc + size, *block[size:])
+			line = '%s%s' % (dbs, ' ' * max(LINE_LENGTH - len(dbs), 1))
+			yield '\t%s; %s-%s' % (line, format_address(pc + size),
+				format_address(pc + len(block) - 1))
+
 
 def format_label(target):
 	return 'Function%04x' % target
@@ -45,422 +142,2394 @@ def format_label(target):
 def format_address(address):
 	return '%06x' % address
 
-def format_bytes(bytes):
-	return ' '.join('%02x' % b for b in bytes)
+def address_to_bank(address):
+	return address // BANK_SIZE
 
-def bank_offset_to_address(bank_offset):
-	bank, offset = bank_offset.split(':')
-	bank = int(bank, 16)
-	offset = int(offset, 16)
-	if bank > 0x00:
-		bank -= 1
-	return bank * 0x4000 + offset
+def address_to_offset(address):
+	# the $0000-$3fff or $4000-$7fff address that the CPU sees for a ROM address
+	return address if address < BANK_SIZE else BANK_SIZE | address % BANK_SIZE
+
+
+def load_rom(filename):
+	with open(filename, 'rb') as f:
+		try:
+			return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+		except ValueError:
+			# empty files cannot be mapped
+			return memoryview(b'')
+
+
+def analysis_key(rom, entry_point=0x000000, sym_filename=None, tables=False,
+	signatures=None, mode='serial'):
+	# identifies an analysis by everything that the trace depends on, including how it
+	# was traced, which decides between overlapping instructions
+	key = hashlib.blake2b(digest_size=20)
+	key.update(b'%d %x %d %s%s\n' % (CACHE_VERSION, entry_point, len(rom),
+		mode.encode('ascii'), b' tables' if tables else b''))
+	key.update(rom)
+	if sym_filename:
+		with open(sym_filename, 'rb') as f:
+			key.update(f.read())
+	if signatures:
+		key.update(signatures.digest())
+	return key.hexdigest()
+
+
+def source_key(filename, entry_point=0x000000, sym_filename=None, nearest_labels=False,
+	mode='serial'):
+	# identifies a ROM being worked on, whatever its current contents
+	key = hashlib.blake2b(digest_size=20)
+	key.update(('%s\n%s\n%x' % (os.path.abspath(filename),
+		sym_filename and os.path.abspath(sym_filename), entry_point)).encode('utf-8'))
+	if nearest_labels:
+		# the listing differs
+		key.update(b'\nnearest labels')
+	if mode != 'serial':
+		key.update(b'\n' + mode.encode('ascii'))
+	return key.hexdigest()
+
+
+def block_checksums(rom):
+	return array(UINT32_TYPECODE, (zlib.crc32(rom[i:i + CHECKSUM_BLOCK_SIZE])
+		for i in range(0, len(rom), CHECKSUM_BLOCK_SIZE)))
+
+def changed_ranges(old_checksums, new_checksums, size):
+	ranges = []
+	for block, (old, new) in enumerate(zip(old_checksums, new_checksums)):
+		if old != new:
+			start = block * CHECKSUM_BLOCK_SIZE
+			if ranges and ranges[-1][1] == start:
+				ranges[-1][1] += CHECKSUM_BLOCK_SIZE
+			else:
+				ranges.append([start, start + CHECKSUM_BLOCK_SIZE])
+	# the last block ends with the ROM
+	if ranges:
+		ranges[-1][1] = min(ranges[-1][1], size)
+	return ranges
 
 
 def parse_symfile(filename):
+	labels = defaultdict(set)
+	ram_labels = defaultdict(set)
 	with open(filename, 'r') as f:
-		lines = f.readlines()
-	labels = defaultdict(lambda: set())
-	for line in lines:
-		line = line.split(';')[0].strip()
-		if not line:
-			continue
-		bank_offset, label = line.split()
-		address = bank_offset_to_address(bank_offset)
-		labels[address].add(label)
-	return labels
+		for line in f:
+			if ';' in line:
+				line = line.partition(';')[0]
+			fields = line.split()
+			if not fields:
+				continue
+			bank_offset, label = fields
+			bank, _, offset = bank_offset.partition(':')
+			offset = int(offset, 16)
+			if offset < 2 * BANK_SIZE:
+				bank = int(bank, 16)
+				labels[(bank - 1 if bank else 0) * BANK_SIZE + offset].add(label)
+			else:
+				# WRAM, HRAM, etc. are not banked like ROM
+				ram_labels[offset].add(label)
+	return labels, ram_labels
 
+def label_order(name):
+	# global labels first, then local ones, each in alphabetical order
+	return '.' in name, name
 
-def create_ret(pc):
-	global terminate
-	terminate = True
-	return 'ret'
-
-def create_jp_hl(pc):
-	global terminate
-	terminate = True
-	return 'jp hl'
-
-def create_jr(pc, offset, condition=None):
-	global terminate
-	if not condition:
-		terminate = True
-	target = pc + 2 + signed(offset)
-	return create_branch('jr', target, condition)
-
-def create_jp(pc, lo, hi, condition=None):
-	global terminate
-	if not condition:
-		terminate = True
-	target = hi << 8 | lo
-	return create_branch('jp', target, condition)
-
-def create_call(pc, lo, hi, condition=None):
-	target = hi << 8 | lo
-	return create_branch('call', target, condition)
-
-def create_branch(op, target, condition=None):
-	global starting_points, labels
-	starting_points.add(target)
-	if target in labels:
-		label = next(iter(labels[target]))
-	else:
-		label = format_label(target)
-		labels[target].add(label)
-	if condition:
-		return '%s %s, %s' % (op, condition, label)
-	return '%s %s' % (op, label)
+def primary_label(names):
+	return min(names, key=label_order)
 
+def is_generated_label(address, names):
+	# only the FunctionXXXX name that tracing gives a branch target
+	return len(names) == 1 and format_label(address) in names
 
-def get_prefix_opcode(pc, b):
-	ops = (['rlc', 'rrc', 'rl', 'rr', 'sla', 'sra', 'swap', 'srl'] +
-		['bit %d,' % i for i in range(8)] + ['res %d,' % i for i in range(8)] +
-		['set %d,' % i for i in range(8)])
-	args = ['b', 'c', 'd', 'e', 'h', 'l', '[hl]', 'a']
-	op, arg = divmod(b, 8)
-	return '%s %s' % (ops[op], args[arg])
 
+class LabelIndex:
+	# labels sorted by address, for finding the nearest label before an address
+
+	def __init__(self, labels, generated=True):
+		self.addresses = array(UINT32_TYPECODE, sorted(address
+			for address, names in labels.items()
+			if names and (generated or not is_generated_label(address, names))))
+		self.names = [primary_label(labels[address]) for address in self.addresses]
+
+	def nearest(self, address):
+		i = bisect_right(self.addresses, address) - 1
+		if i < 0:
+			return None, None
+		return self.addresses[i], self.names[i]
+
+
+class SignatureLibrary:
+	# byte patterns of known routines, each indexed by one n-gram, so that a ROM is
+	# matched against all of them in a single pass
+
+	def __init__(self, filenames=()):
+		self.names = []
+		# length, mask and masked value of each pattern, as little-endian integers
+		self.patterns = []
+		# n-gram to (signature, offset of the n-gram in it)
+		self.index = defaultdict(list)
+		self.lines = []
+		for filename in filenames:
+			self.load(filename)
+
+	def load(self, filename):
+		# one "Name 2a 12 ?? ..." line per signature, with ?? for bytes that can differ
+		with open(filename, 'r') as f:
+			for number, line in enumerate(f, 1):
+				fields = line.partition('#')[0].split()
+				if not fields:
+					continue
+				try:
+					self.add(fields[0], ''.join(fields[1:]))
+				except ValueError as e:
+					raise ValueError('%s:%d: %s' % (filename, number, e))
+
+	def add(self, name, pattern):
+		# pattern is hexadecimal, with ?? for each byte that can differ
+		pattern = pattern.lower()
+		if len(pattern) % 2:
+			raise ValueError('odd number of hex digits for %s' % name)
+		pairs = [pattern[i:i + 2] for i in range(0, len(pattern), 2)]
+		value = bytes(0 if pair == '??' else int(pair, 16) for pair in pairs)
+		mask = bytes(0 if pair == '??' else 0xff for pair in pairs)
+		size = SIGNATURE_GRAM_SIZE
+		offsets = [i for i in range(len(pairs) - size + 1) if all(mask[i:i + size])]
+		if not offsets:
+			raise ValueError('%s has no %d bytes in a row without wildcards' % (name, size))
+		# the most varied n-gram, which is the least likely to match by chance
+		offset = max(offsets, key=lambda i: len(set(value[i:i + size])))
+		self.index[int.from_bytes(value[offset:offset + size], 'little')].append(
+			(len(self.names), offset))
+		self.names.append(name)
+		self.patterns.append((len(value), int.from_bytes(mask, 'little'),
+			int.from_bytes(value, 'little')))
+		self.lines.append('%s %s' % (name, pattern))
+
+	def digest(self):
+		return hashlib.blake2b('\n'.join(self.lines).encode('utf-8'), digest_size=20).digest()
+
+	def find(self, rom):
+		# (address, name) for each match, in address order, longer signatures first
+		rom = memoryview(rom)
+		index, patterns, size = self.index, self.patterns, SIGNATURE_GRAM_SIZE
+		matches = []
+		for alignment in range(size):
+			count = max(len(rom) - alignment, 0) // size
+			grams = array(UINT32_TYPECODE)
+			grams.frombytes(rom[alignment:alignment + size * count])
+			if sys.byteorder != 'little':
+				grams.byteswap()
+			for i in compress(range(count), map(index.__contains__, grams)):
+				for signature, offset in index[grams[i]]:
+					start = alignment + size * i - offset
+					length, mask, value = patterns[signature]
+					if 0 <= start and start + length <= len(rom) and int.from_bytes(
+						rom[start:start + length], 'little') & mask == value:
+						matches.append((start, -length, self.names[signature]))
+		return [(address, name) for address, _, name in sorted(matches)]
+
+	def labels(self, rom, known=()):
+		# a label for each match at an address without one, numbering the later
+		# matches of a name so that each label is unique
+		labels = defaultdict(set)
+		counts = defaultdict(int)
+		for address, name in self.find(rom):
+			if address in known or address in labels:
+				continue
+			counts[name] += 1
+			labels[address].add(name if counts[name] == 1 else '%s_%d' % (name, counts[name]))
+		return labels
+
+
+# operand kinds
+OP_NONE  = 0 # no operand
+OP_D8    = 1 # immediate byte
+OP_D16   = 2 # immediate word
+OP_R8    = 3 # signed byte
+OP_SP_R8 = 4 # signed byte added to sp
+OP_LDH   = 5 # $ff00+a8 hardware register
+OP_JR    = 6 # relative branch target
+OP_ADDR  = 7 # absolute branch target
+OP_CB    = 8 # prefixed opcode
+
+# control flow
+FLOW_JUMP = 0x01
+FLOW_CALL = 0x02
+FLOW_END  = 0x04 # execution does not continue with the next instruction
 
 opcode_table = [
-	(0, lambda pc: 'nop'),                               # 00 - nop
-	(2, lambda pc, a, b: 'ld bc, %s' % u16le(a, b)),     # 01 - ld bc, d16
-	(0, lambda pc: 'ld bc, a'),                          # 02 - ld bc, a
-	(0, lambda pc: 'inc bc'),                            # 03 - inc bc
-	(0, lambda pc: 'inc b'),                             # 04 - inc b
-	(0, lambda pc: 'dec b'),                             # 05 - dec b
-	(1, lambda pc, a: 'ld b, %s' % u8(a)),               # 06 - ld b, d8
-	(0, lambda pc: 'rlca'),                              # 07 - rlca
-	(2, lambda pc, a, b: 'ld [%s], sp' % u16le(a, b)),   # 08 - ld [d16], sp
-	(0, lambda pc: 'add hl, bc'),                        # 09 - add hl, bc
-	(0, lambda pc: 'ld a, [bc]'),                        # 0a - ld a, [bc]
-	(0, lambda pc: 'dec bc'),                            # 0b - dec bc
-	(0, lambda pc: 'inc c'),                             # 0c - inc c
-	(0, lambda pc: 'dec c'),                             # 0d - dec c
-	(1, lambda pc, a: 'ld c, %s' % u8(a)),               # 0e - ld c, d8
-	(0, lambda pc: 'rrca'),                              # 0f - rrca
-	(0, lambda pc: 'stop'),                              # 10 - stop
-	(2, lambda pc, a, b: 'ld de, %s' % u16le(a, b)),     # 11 - ld de, d16
-	(0, lambda pc: 'ld [de], a'),                        # 12 - ld [de], a
-	(0, lambda pc: 'inc de'),                            # 13 - inc de
-	(0, lambda pc: 'inc d'),                             # 14 - inc d
-	(0, lambda pc: 'dec d'),                             # 15 - dec d
-	(1, lambda pc, a: 'ld d, %s' % u8(a)),               # 16 - ld d, d8
-	(0, lambda pc: 'rla'),                               # 17 - rla
-	(1, create_jr),                                      # 18 - jr r8
-	(0, lambda pc: 'add hl, de'),                        # 19 - add hl, de
-	(0, lambda pc: 'ld a, [de]'),                        # 1a - ld a, [de]
-	(0, lambda pc: 'dec de'),                            # 1b - dec de
-	(0, lambda pc: 'inc e'),                             # 1c - inc e
-	(0, lambda pc: 'dec e'),                             # 1d - dec e
-	(1, lambda pc, a: 'ld e, %s' % u8(a)),               # 1e - ld e, d8
-	(0, lambda pc: 'rra'),                               # 1f - rra
-	(1, lambda pc, a: create_jr(pc, a, 'nz')),           # 20 - jr nz, r8
-	(2, lambda pc, a, b: 'ld hl, %s' % u16le(a, b)),     # 21 - ld hl, d16
-	(0, lambda pc: 'ld [hli], a'),                       # 22 - ld [hli], a
-	(0, lambda pc: 'inc hl'),                            # 23 - inc hl
-	(0, lambda pc: 'inc h'),                             # 24 - inc h
-	(0, lambda pc: 'dec h'),                             # 25 - dec h
-	(1, lambda pc, a: 'ld h, %s' % u8(a)),               # 26 - ld h, d8
-	(0, lambda pc: 'daa'),                               # 27 - daa
-	(1, lambda pc, a: create_jr(pc, a, 'z')),            # 28 - jr z, r8
-	(0, lambda pc: 'add hl, hl'),                        # 29 - add hl, hl
-	(0, lambda pc: 'ld a, [hli]'),                       # 2a - ld a, [dli]
-	(0, lambda pc: 'dec hl'),                            # 2b - dec hl
-	(0, lambda pc: 'inc l'),                             # 2c - inc l
-	(0, lambda pc: 'dec l'),                             # 2d - dec l
-	(1, lambda pc, a: 'ld l, %s' % u8(a)),               # 2e - ld l, d8
-	(0, lambda pc: 'cpl'),                               # 2f - cpl
-	(1, lambda pc, a: create_jr(pc, a, 'nc')),           # 30 - jr nc, r8
-	(2, lambda pc, a, b: 'ld sp, %s' % u16le(a, b)),     # 31 - ld sp, d16
-	(0, lambda pc: 'ld [hld], a'),                       # 32 - ld [hld], a
-	(0, lambda pc: 'inc sp'),                            # 33 - inc sp
-	(0, lambda pc: 'inc [hl]'),                          # 34 - inc [hl]
-	(0, lambda pc: 'dec [hl]'),                          # 35 - dec [hl]
-	(1, lambda pc, a: 'ld [hl], %s' % u8(a)),            # 36 - ld [hl], d8
-	(0, lambda pc: 'scf'),                               # 37 - scf
-	(1, lambda pc, a: create_jr(pc, a, 'c')),            # 38 - jr c, r8
-	(0, lambda pc: 'add hl, sp'),                        # 39 - add hl, sp
-	(0, lambda pc: 'ld a, [hld]'),                       # 3a - ld a, [hld]
-	(0, lambda pc: 'dec sp'),                            # 3b - dec sp
-	(0, lambda pc: 'inc a'),                             # 3c - inc a
-	(0, lambda pc: 'dec a'),                             # 3d - dec a
-	(1, lambda pc, a: 'ld a, %s' % u8(a)),               # 3e - ld a, d8
-	(0, lambda pc: 'ccf'),                               # 3f - ccf
-	(0, lambda pc: 'ld b, b'),                           # 40 - ld b, b
-	(0, lambda pc: 'ld b, c'),                           # 41 - ld b, c
-	(0, lambda pc: 'ld b, d'),                           # 42 - ld b, d
-	(0, lambda pc: 'ld b, e'),                           # 43 - ld b, e
-	(0, lambda pc: 'ld b, h'),                           # 44 - ld b, h
-	(0, lambda pc: 'ld b, l'),                           # 45 - ld b, l
-	(0, lambda pc: 'ld b, [hl]'),                        # 46 - ld b, [hl]
-	(0, lambda pc: 'ld b, a'),                           # 47 - ld b, a
-	(0, lambda pc: 'ld c, b'),                           # 48 - ld c, b
-	(0, lambda pc: 'ld c, c'),                           # 49 - ld c, c
-	(0, lambda pc: 'ld c, d'),                           # 4a - ld c, d
-	(0, lambda pc: 'ld c, e'),                           # 4b - ld c, e
-	(0, lambda pc: 'ld c, h'),                           # 4c - ld c, h
-	(0, lambda pc: 'ld c, l'),                           # 4d - ld c, l
-	(0, lambda pc: 'ld c, [hl]'),                        # 4e - ld c, [hl]
-	(0, lambda pc: 'ld c, a'),                           # 4f - ld c, a
-	(0, lambda pc: 'ld d, b'),                           # 50 - ld d, b
-	(0, lambda pc: 'ld d, c'),                           # 51 - ld d, c
-	(0, lambda pc: 'ld d, d'),                           # 52 - ld d, d
-	(0, lambda pc: 'ld d, e'),                           # 53 - ld d, e
-	(0, lambda pc: 'ld d, h'),                           # 54 - ld d, h
-	(0, lambda pc: 'ld d, l'),                           # 55 - ld d, l
-	(0, lambda pc: 'ld d, [hl]'),                        # 56 - ld d, [hl]
-	(0, lambda pc: 'ld d, a'),                           # 57 - ld d, a
-	(0, lambda pc: 'ld e, b'),                           # 58 - ld e, b
-	(0, lambda pc: 'ld e, c'),                           # 59 - ld e, c
-	(0, lambda pc: 'ld e, d'),                           # 5a - ld e, d
-	(0, lambda pc: 'ld e, e'),                           # 5b - ld e, e
-	(0, lambda pc: 'ld e, h'),                           # 5c - ld e, h
-	(0, lambda pc: 'ld e, l'),                           # 5d - ld e, l
-	(0, lambda pc: 'ld e, [hl]'),                        # 5e - ld e, [hl]
-	(0, lambda pc: 'ld e, a'),                           # 5f - ld e, a
-	(0, lambda pc: 'ld h, b'),                           # 60 - ld h, b
-	(0, lambda pc: 'ld h, c'),                           # 61 - ld h, c
-	(0, lambda pc: 'ld h, d'),                           # 62 - ld h, d
-	(0, lambda pc: 'ld h, e'),                           # 63 - ld h, e
-	(0, lambda pc: 'ld h, h'),                           # 64 - ld h, h
-	(0, lambda pc: 'ld h, l'),                           # 65 - ld h, l
-	(0, lambda pc: 'ld h, [hl]'),                        # 66 - ld h, [hl]
-	(0, lambda pc: 'ld h, a'),                           # 67 - ld h, a
-	(0, lambda pc: 'ld l, b'),                           # 68 - ld l, b
-	(0, lambda pc: 'ld l, c'),                           # 69 - ld l, c
-	(0, lambda pc: 'ld l, d'),                           # 6a - ld l, d
-	(0, lambda pc: 'ld l, e'),                           # 6b - ld l, e
-	(0, lambda pc: 'ld l, h'),                           # 6c - ld l, h
-	(0, lambda pc: 'ld l, l'),                           # 6d - ld l, l
-	(0, lambda pc: 'ld l, [hl]'),                        # 6e - ld l, [hl]
-	(0, lambda pc: 'ld l, a'),                           # 6f - ld l, a
-	(0, lambda pc: 'ld [hl], b'),                        # 70 - ld [hl], b
-	(0, lambda pc: 'ld [hl], c'),                        # 71 - ld [hl], c
-	(0, lambda pc: 'ld [hl], d'),                        # 72 - ld [hl], d
-	(0, lambda pc: 'ld [hl], e'),                        # 73 - ld [hl], e
-	(0, lambda pc: 'ld [hl], h'),                        # 74 - ld [hl], h
-	(0, lambda pc: 'ld [hl], l'),                        # 75 - ld [hl], l
-	(0, lambda pc: 'halt'),                              # 76 - halt
-	(0, lambda pc: 'ld [hl], a'),                        # 77 - ld [hl], a
-	(0, lambda pc: 'ld a, b'),                           # 78 - ld a, b
-	(0, lambda pc: 'ld a, c'),                           # 79 - ld a, c
-	(0, lambda pc: 'ld a, d'),                           # 7a - ld a, d
-	(0, lambda pc: 'ld a, e'),                           # 7b - ld a, e
-	(0, lambda pc: 'ld a, h'),                           # 7c - ld a, h
-	(0, lambda pc: 'ld a, l'),                           # 7d - ld a, l
-	(0, lambda pc: 'ld a, [hl]'),                        # 7e - ld a, [hl]
-	(0, lambda pc: 'ld a, a'),                           # 7f - ld a, a
-	(0, lambda pc: 'add b'),                             # 80 - add b
-	(0, lambda pc: 'add c'),                             # 81 - add c
-	(0, lambda pc: 'add d'),                             # 82 - add d
-	(0, lambda pc: 'add e'),                             # 83 - add e
-	(0, lambda pc: 'add h'),                             # 84 - add h
-	(0, lambda pc: 'add l'),                             # 85 - add l
-	(0, lambda pc: 'add [hl]'),                          # 86 - add [hl]
-	(0, lambda pc: 'add a'),                             # 87 - add a
-	(0, lambda pc: 'adc b'),                             # 88 - adc b
-	(0, lambda pc: 'adc c'),                             # 89 - adc c
-	(0, lambda pc: 'adc d'),                             # 8a - adc d
-	(0, lambda pc: 'adc e'),                             # 8b - adc e
-	(0, lambda pc: 'adc h'),                             # 8c - adc h
-	(0, lambda pc: 'adc l'),                             # 8d - adc l
-	(0, lambda pc: 'adc [hl]'),                          # 8e - adc [hl]
-	(0, lambda pc: 'adc a'),                             # 8f - adc a
-	(0, lambda pc: 'sub b'),                             # 90 - sub b
-	(0, lambda pc: 'sub c'),                             # 91 - sub c
-	(0, lambda pc: 'sub d'),                             # 92 - sub d
-	(0, lambda pc: 'sub e'),                             # 93 - sub e
-	(0, lambda pc: 'sub h'),                             # 94 - sub h
-	(0, lambda pc: 'sub l'),                             # 95 - sub l
-	(0, lambda pc: 'sub [hl]'),                          # 96 - sub [hl]
-	(0, lambda pc: 'sub a'),                             # 97 - sub a
-	(0, lambda pc: 'sbc b'),                             # 98 - sbc b
-	(0, lambda pc: 'sbc c'),                             # 99 - sbc c
-	(0, lambda pc: 'sbc d'),                             # 9a - sbc d
-	(0, lambda pc: 'sbc e'),                             # 9b - sbc e
-	(0, lambda pc: 'sbc h'),                             # 9c - sbc h
-	(0, lambda pc: 'sbc l'),                             # 9d - sbc l
-	(0, lambda pc: 'sbc [hl]'),                          # 9e - sbc [hl]
-	(0, lambda pc: 'sbc a'),                             # 9f - sbc a
-	(0, lambda pc: 'and b'),                             # a0 - and b
-	(0, lambda pc: 'and c'),                             # a1 - and c
-	(0, lambda pc: 'and d'),                             # a2 - and d
-	(0, lambda pc: 'and e'),                             # a3 - and e
-	(0, lambda pc: 'and h'),                             # a4 - and h
-	(0, lambda pc: 'and l'),                             # a5 - and l
-	(0, lambda pc: 'and [hl]'),                          # a6 - and [hl]
-	(0, lambda pc: 'and a'),                             # a7 - and a
-	(0, lambda pc: 'xor b'),                             # a8 - xor b
-	(0, lambda pc: 'xor c'),                             # a9 - xor c
-	(0, lambda pc: 'xor d'),                             # aa - xor d
-	(0, lambda pc: 'xor e'),                             # ab - xor e
-	(0, lambda pc: 'xor h'),                             # ac - xor h
-	(0, lambda pc: 'xor l'),                             # ad - xor l
-	(0, lambda pc: 'xor [hl]'),                          # ae - xor [hl]
-	(0, lambda pc: 'xor a'),                             # af - xor a
-	(0, lambda pc: 'or b'),                              # b0 - or b
-	(0, lambda pc: 'or c'),                              # b1 - or c
-	(0, lambda pc: 'or d'),                              # b2 - or d
-	(0, lambda pc: 'or e'),                              # b3 - or e
-	(0, lambda pc: 'or h'),                              # b4 - or h
-	(0, lambda pc: 'or l'),                              # b5 - or l
-	(0, lambda pc: 'or [hl]'),                           # b6 - or [hl]
-	(0, lambda pc: 'or a'),                              # b7 - or a
-	(0, lambda pc: 'cp b'),                              # b8 - cp b
-	(0, lambda pc: 'cp c'),                              # b9 - cp c
-	(0, lambda pc: 'cp d'),                              # ba - cp d
-	(0, lambda pc: 'cp e'),                              # bb - cp e
-	(0, lambda pc: 'cp h'),                              # bc - cp h
-	(0, lambda pc: 'cp l'),                              # bd - cp l
-	(0, lambda pc: 'cp [hl]'),                           # be - cp [hl]
-	(0, lambda pc: 'cp a'),                              # bf - cp a
-	(0, lambda pc: 'ret nz'),                            # c0 - ret nz
-	(0, lambda pc: 'pop bc'),                            # c1 - pop bc
-	(2, lambda pc, a, b: create_jp(pc, a, b, 'nz')),     # c2 - jp nz, a16
-	(2, create_jp),                                      # c3 - jp a16
-	(2, lambda pc, a, b: create_call(pc, a, b, 'nz')),   # c4 - call nz, a16
-	(0, lambda pc: 'push bc'),                           # c5 - push bc
-	(1, lambda pc, a: 'add %s' % u8(a)),                 # c6 - add d8
-	(0, lambda pc: 'rst $0'),                            # c7 - rst $0
-	(0, lambda pc: 'ret z'),                             # c8 - ret z
-	(0, create_ret),                                     # c9 - ret
-	(2, lambda pc, a, b: create_jp(pc, a, b, 'z')),      # ca - jp z, a16
-	(1, get_prefix_opcode),                              # cb - prefix
-	(2, lambda pc, a, b: create_call(pc, a, b, 'z')),    # cc - call z, a16
-	(2, create_call),                                    # cd - call a16
-	(1, lambda pc, a: 'adc %s' % u8(a)),                 # ce - adc d8
-	(0, lambda pc: 'rst $8'),                            # cf - rst $8
-	(0, lambda pc: 'ret nc'),                            # d0 - ret nc
-	(0, lambda pc: 'pop de'),                            # d1 - pop de
-	(2, lambda pc, a, b: create_jp(pc, a, b, 'nc')),     # d2 - jp nc, a16
-	(0, lambda pc: 'db $d3'),                            # d3 -
-	(2, lambda pc, a, b: create_call(pc, a, b, 'nc')),   # d4 - call nc, a16
-	(0, lambda pc: 'push de'),                           # d5 - push de
-	(1, lambda pc, a: 'sub %s' % u8(a)),                 # d6 - sub d8
-	(0, lambda pc: 'rst $10'),                           # d7 - rst $10
-	(0, lambda pc: 'ret c'),                             # d8 - ret c
-	(0, lambda pc: 'reti'),                              # d9 - reti
-	(2, lambda pc, a, b: create_jp(pc, a, b, 'c')),      # da - jp c, a16
-	(0, lambda pc: 'db $db'),                            # db -
-	(2, lambda pc, a, b: create_call(pc, a, b, 'c')),    # dc - call c, a16
-	(0, lambda pc: 'db $dd'),                            # dd -
-	(1, lambda pc, a: 'sbc %s' % u8(a)),                 # de - sbc d8
-	(0, lambda pc: 'rst $18'),                           # df - rst $18
-	(1, lambda pc, a: create_ldh_to(a)),                 # e0 - ld [$ff00+a8], a
-	(0, lambda pc: 'pop hl'),                            # e1 - pop hl
-	(0, lambda pc: 'ld [$ff00+c], a'),                   # e2 - ld [$ff00+c], a
-	(0, lambda pc: 'db $e3'),                            # e3 -
-	(0, lambda pc: 'db $e4'),                            # e4 -
-	(0, lambda pc: 'push hl'),                           # e5 - push hl
-	(1, lambda pc, a: 'and %s' % u8(a)),                 # e6 - and d8
-	(0, lambda pc: 'rst $20'),                           # e7 - rst $20
-	(1, lambda pc, a: 'add sp, %s' % s8(a, plus=False)), # e8 - add sp, r8
-	(0, create_jp_hl),                                   # e9 - jp hl
-	(2, lambda pc, a, b: 'ld [%s], a' % u16le(a, b)),    # ea - ld [a16], a
-	(0, lambda pc: 'db $eb'),                            # eb -
-	(0, lambda pc: 'db $ec'),                            # ec -
-	(0, lambda pc: 'db $ed'),                            # ed -
-	(1, lambda pc, a: 'xor %s' % u8(a)),                 # ee - xor d8
-	(0, lambda pc: 'rst $28'),                           # ef - rst $28
-	(1, lambda pc, a: create_ldh_from(a)),               # f0 - ld a, [$ff00+a8]
-	(0, lambda pc: 'pop af'),                            # f1 - pop af
-	(0, lambda pc: 'ld a, [$ff00+c]'),                   # f2 - ld a, [$ff00+c]
-	(0, lambda pc: 'di'),                                # f3 - di
-	(0, lambda pc: 'db $f4'),                            # f4 -
-	(0, lambda pc: 'push af'),                           # f5 - push af
-	(1, lambda pc, a: 'or %s' % u8(a)),                  # f6 - or d8
-	(0, lambda pc: 'rst $30'),                           # f7 - rst $30
-	(1, lambda pc, a: 'ld hl, sp%s' % s8(a, plus=True)), # f8 - ld hl, sp+r8
-	(0, lambda pc: 'ld sp, hl'),                         # f9 - ld sp, hl
-	(2, lambda pc, a, b: 'ld a, [%s]' % u16le(a, b)),    # fa - ld a, [a16]
-	(0, lambda pc: 'ei'),                                # fb - ei
-	(0, lambda pc: 'db $fc'),                            # fc -
-	(0, lambda pc: 'db $fd'),                            # fd -
-	(1, lambda pc, a: 'cp %s' % u8(a)),                  # fe - cp d8
-	(0, lambda pc: 'rst $38'),                           # ff - rst $38
+	(0, 'nop', OP_NONE, 0),                          # 00 - nop
+	(2, 'ld bc, %s', OP_D16, 0),                     # 01 - ld bc, d16
+	(0, 'ld bc, a', OP_NONE, 0),                     # 02 - ld bc, a
+	(0, 'inc bc', OP_NONE, 0),                       # 03 - inc bc
+	(0, 'inc b', OP_NONE, 0),                        # 04 - inc b
+	(0, 'dec b', OP_NONE, 0),                        # 05 - dec b
+	(1, 'ld b, %s', OP_D8, 0),                       # 06 - ld b, d8
+	(0, 'rlca', OP_NONE, 0),                         # 07 - rlca
+	(2, 'ld [%s], sp', OP_D16, 0),                   # 08 - ld [d16], sp
+	(0, 'add hl, bc', OP_NONE, 0),                   # 09 - add hl, bc
+	(0, 'ld a, [bc]', OP_NONE, 0),                   # 0a - ld a, [bc]
+	(0, 'dec bc', OP_NONE, 0),                       # 0b - dec bc
+	(0, 'inc c', OP_NONE, 0),                        # 0c - inc c
+	(0, 'dec c', OP_NONE, 0),                        # 0d - dec c
+	(1, 'ld c, %s', OP_D8, 0),                       # 0e - ld c, d8
+	(0, 'rrca', OP_NONE, 0),                         # 0f - rrca
+	(0, 'stop', OP_NONE, 0),                         # 10 - stop
+	(2, 'ld de, %s', OP_D16, 0),                     # 11 - ld de, d16
+	(0, 'ld [de], a', OP_NONE, 0),                   # 12 - ld [de], a
+	(0, 'inc de', OP_NONE, 0),                       # 13 - inc de
+	(0, 'inc d', OP_NONE, 0),                        # 14 - inc d
+	(0, 'dec d', OP_NONE, 0),                        # 15 - dec d
+	(1, 'ld d, %s', OP_D8, 0),                       # 16 - ld d, d8
+	(0, 'rla', OP_NONE, 0),                          # 17 - rla
+	(1, 'jr %s', OP_JR, FLOW_JUMP | FLOW_END),       # 18 - jr r8
+	(0, 'add hl, de', OP_NONE, 0),                   # 19 - add hl, de
+	(0, 'ld a, [de]', OP_NONE, 0),                   # 1a - ld a, [de]
+	(0, 'dec de', OP_NONE, 0),                       # 1b - dec de
+	(0, 'inc e', OP_NONE, 0),                        # 1c - inc e
+	(0, 'dec e', OP_NONE, 0),                        # 1d - dec e
+	(1, 'ld e, %s', OP_D8, 0),                       # 1e - ld e, d8
+	(0, 'rra', OP_NONE, 0),                          # 1f - rra
+	(1, 'jr nz, %s', OP_JR, FLOW_JUMP),              # 20 - jr nz, r8
+	(2, 'ld hl, %s', OP_D16, 0),                     # 21 - ld hl, d16
+	(0, 'ld [hli], a', OP_NONE, 0),                  # 22 - ld [hli], a
+	(0, 'inc hl', OP_NONE, 0),                       # 23 - inc hl
+	(0, 'inc h', OP_NONE, 0),                        # 24 - inc h
+	(0, 'dec h', OP_NONE, 0),                        # 25 - dec h
+	(1, 'ld h, %s', OP_D8, 0),                       # 26 - ld h, d8
+	(0, 'daa', OP_NONE, 0),                          # 27 - daa
+	(1, 'jr z, %s', OP_JR, FLOW_JUMP),               # 28 - jr z, r8
+	(0, 'add hl, hl', OP_NONE, 0),                   # 29 - add hl, hl
+	(0, 'ld a, [hli]', OP_NONE, 0),                  # 2a - ld a, [dli]
+	(0, 'dec hl', OP_NONE, 0),                       # 2b - dec hl
+	(0, 'inc l', OP_NONE, 0),                        # 2c - inc l
+	(0, 'dec l', OP_NONE, 0),                        # 2d - dec l
+	(1, 'ld l, %s', OP_D8, 0),                       # 2e - ld l, d8
+	(0, 'cpl', OP_NONE, 0),                          # 2f - cpl
+	(1, 'jr nc, %s', OP_JR, FLOW_JUMP),              # 30 - jr nc, r8
+	(2, 'ld sp, %s', OP_D16, 0),                     # 31 - ld sp, d16
+	(0, 'ld [hld], a', OP_NONE, 0),                  # 32 - ld [hld], a
+	(0, 'inc sp', OP_NONE, 0),                       # 33 - inc sp
+	(0, 'inc [hl]', OP_NONE, 0),                     # 34 - inc [hl]
+	(0, 'dec [hl]', OP_NONE, 0),                     # 35 - dec [hl]
+	(1, 'ld [hl], %s', OP_D8, 0),                    # 36 - ld [hl], d8
+	(0, 'scf', OP_NONE, 0),                          # 37 - scf
+	(1, 'jr c, %s', OP_JR, FLOW_JUMP),               # 38 - jr c, r8
+	(0, 'add hl, sp', OP_NONE, 0),                   # 39 - add hl, sp
+	(0, 'ld a, [hld]', OP_NONE, 0),                  # 3a - ld a, [hld]
+	(0, 'dec sp', OP_NONE, 0),                       # 3b - dec sp
+	(0, 'inc a', OP_NONE, 0),                        # 3c - inc a
+	(0, 'dec a', OP_NONE, 0),                        # 3d - dec a
+	(1, 'ld a, %s', OP_D8, 0),                       # 3e - ld a, d8
+	(0, 'ccf', OP_NONE, 0),                          # 3f - ccf
+	(0, 'ld b, b', OP_NONE, 0),                      # 40 - ld b, b
+	(0, 'ld b, c', OP_NONE, 0),                      # 41 - ld b, c
+	(0, 'ld b, d', OP_NONE, 0),                      # 42 - ld b, d
+	(0, 'ld b, e', OP_NONE, 0),                      # 43 - ld b, e
+	(0, 'ld b, h', OP_NONE, 0),                      # 44 - ld b, h
+	(0, 'ld b, l', OP_NONE, 0),                      # 45 - ld b, l
+	(0, 'ld b, [hl]', OP_NONE, 0),                   # 46 - ld b, [hl]
+	(0, 'ld b, a', OP_NONE, 0),                      # 47 - ld b, a
+	(0, 'ld c, b', OP_NONE, 0),                      # 48 - ld c, b
+	(0, 'ld c, c', OP_NONE, 0),                      # 49 - ld c, c
+	(0, 'ld c, d', OP_NONE, 0),                      # 4a - ld c, d
+	(0, 'ld c, e', OP_NONE, 0),                      # 4b - ld c, e
+	(0, 'ld c, h', OP_NONE, 0),                      # 4c - ld c, h
+	(0, 'ld c, l', OP_NONE, 0),                      # 4d - ld c, l
+	(0, 'ld c, [hl]', OP_NONE, 0),                   # 4e - ld c, [hl]
+	(0, 'ld c, a', OP_NONE, 0),                      # 4f - ld c, a
+	(0, 'ld d, b', OP_NONE, 0),                      # 50 - ld d, b
+	(0, 'ld d, c', OP_NONE, 0),                      # 51 - ld d, c
+	(0, 'ld d, d', OP_NONE, 0),                      # 52 - ld d, d
+	(0, 'ld d, e', OP_NONE, 0),                      # 53 - ld d, e
+	(0, 'ld d, h', OP_NONE, 0),                      # 54 - ld d, h
+	(0, 'ld d, l', OP_NONE, 0),                      # 55 - ld d, l
+	(0, 'ld d, [hl]', OP_NONE, 0),                   # 56 - ld d, [hl]
+	(0, 'ld d, a', OP_NONE, 0),                      # 57 - ld d, a
+	(0, 'ld e, b', OP_NONE, 0),                      # 58 - ld e, b
+	(0, 'ld e, c', OP_NONE, 0),                      # 59 - ld e, c
+	(0, 'ld e, d', OP_NONE, 0),                      # 5a - ld e, d
+	(0, 'ld e, e', OP_NONE, 0),                      # 5b - ld e, e
+	(0, 'ld e, h', OP_NONE, 0),                      # 5c - ld e, h
+	(0, 'ld e, l', OP_NONE, 0),                      # 5d - ld e, l
+	(0, 'ld e, [hl]', OP_NONE, 0),                   # 5e - ld e, [hl]
+	(0, 'ld e, a', OP_NONE, 0),                      # 5f - ld e, a
+	(0, 'ld h, b', OP_NONE, 0),                      # 60 - ld h, b
+	(0, 'ld h, c', OP_NONE, 0),                      # 61 - ld h, c
+	(0, 'ld h, d', OP_NONE, 0),                      # 62 - ld h, d
+	(0, 'ld h, e', OP_NONE, 0),                      # 63 - ld h, e
+	(0, 'ld h, h', OP_NONE, 0),                      # 64 - ld h, h
+	(0, 'ld h, l', OP_NONE, 0),                      # 65 - ld h, l
+	(0, 'ld h, [hl]', OP_NONE, 0),                   # 66 - ld h, [hl]
+	(0, 'ld h, a', OP_NONE, 0),                      # 67 - ld h, a
+	(0, 'ld l, b', OP_NONE, 0),                      # 68 - ld l, b
+	(0, 'ld l, c', OP_NONE, 0),                      # 69 - ld l, c
+	(0, 'ld l, d', OP_NONE, 0),                      # 6a - ld l, d
+	(0, 'ld l, e', OP_NONE, 0),                      # 6b - ld l, e
+	(0, 'ld l, h', OP_NONE, 0),                      # 6c - ld l, h
+	(0, 'ld l, l', OP_NONE, 0),                      # 6d - ld l, l
+	(0, 'ld l, [hl]', OP_NONE, 0),                   # 6e - ld l, [hl]
+	(0, 'ld l, a', OP_NONE, 0),                      # 6f - ld l, a
+	(0, 'ld [hl], b', OP_NONE, 0),                   # 70 - ld [hl], b
+	(0, 'ld [hl], c', OP_NONE, 0),                   # 71 - ld [hl], c
+	(0, 'ld [hl], d', OP_NONE, 0),                   # 72 - ld [hl], d
+	(0, 'ld [hl], e', OP_NONE, 0),                   # 73 - ld [hl], e
+	(0, 'ld [hl], h', OP_NONE, 0),                   # 74 - ld [hl], h
+	(0, 'ld [hl], l', OP_NONE, 0),                   # 75 - ld [hl], l
+	(0, 'halt', OP_NONE, 0),                         # 76 - halt
+	(0, 'ld [hl], a', OP_NONE, 0),                   # 77 - ld [hl], a
+	(0, 'ld a, b', OP_NONE, 0),                      # 78 - ld a, b
+	(0, 'ld a, c', OP_NONE, 0),                      # 79 - ld a, c
+	(0, 'ld a, d', OP_NONE, 0),                      # 7a - ld a, d
+	(0, 'ld a, e', OP_NONE, 0),                      # 7b - ld a, e
+	(0, 'ld a, h', OP_NONE, 0),                      # 7c - ld a, h
+	(0, 'ld a, l', OP_NONE, 0),                      # 7d - ld a, l
+	(0, 'ld a, [hl]', OP_NONE, 0),                   # 7e - ld a, [hl]
+	(0, 'ld a, a', OP_NONE, 0),                      # 7f - ld a, a
+	(0, 'add b', OP_NONE, 0),                        # 80 - add b
+	(0, 'add c', OP_NONE, 0),                        # 81 - add c
+	(0, 'add d', OP_NONE, 0),                        # 82 - add d
+	(0, 'add e', OP_NONE, 0),                        # 83 - add e
+	(0, 'add h', OP_NONE, 0),                        # 84 - add h
+	(0, 'add l', OP_NONE, 0),                        # 85 - add l
+	(0, 'add [hl]', OP_NONE, 0),                     # 86 - add [hl]
+	(0, 'add a', OP_NONE, 0),                        # 87 - add a
+	(0, 'adc b', OP_NONE, 0),                        # 88 - adc b
+	(0, 'adc c', OP_NONE, 0),                        # 89 - adc c
+	(0, 'adc d', OP_NONE, 0),                        # 8a - adc d
+	(0, 'adc e', OP_NONE, 0),                        # 8b - adc e
+	(0, 'adc h', OP_NONE, 0),                        # 8c - adc h
+	(0, 'adc l', OP_NONE, 0),                        # 8d - adc l
+	(0, 'adc [hl]', OP_NONE, 0),                     # 8e - adc [hl]
+	(0, 'adc a', OP_NONE, 0),                        # 8f - adc a
+	(0, 'sub b', OP_NONE, 0),                        # 90 - sub b
+	(0, 'sub c', OP_NONE, 0),                        # 91 - sub c
+	(0, 'sub d', OP_NONE, 0),                        # 92 - sub d
+	(0, 'sub e', OP_NONE, 0),                        # 93 - sub e
+	(0, 'sub h', OP_NONE, 0),                        # 94 - sub h
+	(0, 'sub l', OP_NONE, 0),                        # 95 - sub l
+	(0, 'sub [hl]', OP_NONE, 0),                     # 96 - sub [hl]
+	(0, 'sub a', OP_NONE, 0),                        # 97 - sub a
+	(0, 'sbc b', OP_NONE, 0),                        # 98 - sbc b
+	(0, 'sbc c', OP_NONE, 0),                        # 99 - sbc c
+	(0, 'sbc d', OP_NONE, 0),                        # 9a - sbc d
+	(0, 'sbc e', OP_NONE, 0),                        # 9b - sbc e
+	(0, 'sbc h', OP_NONE, 0),                        # 9c - sbc h
+	(0, 'sbc l', OP_NONE, 0),                        # 9d - sbc l
+	(0, 'sbc [hl]', OP_NONE, 0),                     # 9e - sbc [hl]
+	(0, 'sbc a', OP_NONE, 0),                        # 9f - sbc a
+	(0, 'and b', OP_NONE, 0),                        # a0 - and b
+	(0, 'and c', OP_NONE, 0),                        # a1 - and c
+	(0, 'and d', OP_NONE, 0),                        # a2 - and d
+	(0, 'and e', OP_NONE, 0),                        # a3 - and e
+	(0, 'and h', OP_NONE, 0),                        # a4 - and h
+	(0, 'and l', OP_NONE, 0),                        # a5 - and l
+	(0, 'and [hl]', OP_NONE, 0),                     # a6 - and [hl]
+	(0, 'and a', OP_NONE, 0),                        # a7 - and a
+	(0, 'xor b', OP_NONE, 0),                        # a8 - xor b
+	(0, 'xor c', OP_NONE, 0),                        # a9 - xor c
+	(0, 'xor d', OP_NONE, 0),                        # aa - xor d
+	(0, 'xor e', OP_NONE, 0),                        # ab - xor e
+	(0, 'xor h', OP_NONE, 0),                        # ac - xor h
+	(0, 'xor l', OP_NONE, 0),                        # ad - xor l
+	(0, 'xor [hl]', OP_NONE, 0),                     # ae - xor [hl]
+	(0, 'xor a', OP_NONE, 0),                        # af - xor a
+	(0, 'or b', OP_NONE, 0),                         # b0 - or b
+	(0, 'or c', OP_NONE, 0),                         # b1 - or c
+	(0, 'or d', OP_NONE, 0),                         # b2 - or d
+	(0, 'or e', OP_NONE, 0),                         # b3 - or e
+	(0, 'or h', OP_NONE, 0),                         # b4 - or h
+	(0, 'or l', OP_NONE, 0),                         # b5 - or l
+	(0, 'or [hl]', OP_NONE, 0),                      # b6 - or [hl]
+	(0, 'or a', OP_NONE, 0),                         # b7 - or a
+	(0, 'cp b', OP_NONE, 0),                         # b8 - cp b
+	(0, 'cp c', OP_NONE, 0),                         # b9 - cp c
+	(0, 'cp d', OP_NONE, 0),                         # ba - cp d
+	(0, 'cp e', OP_NONE, 0),                         # bb - cp e
+	(0, 'cp h', OP_NONE, 0),                         # bc - cp h
+	(0, 'cp l', OP_NONE, 0),                         # bd - cp l
+	(0, 'cp [hl]', OP_NONE, 0),                      # be - cp [hl]
+	(0, 'cp a', OP_NONE, 0),                         # bf - cp a
+	(0, 'ret nz', OP_NONE, 0),                       # c0 - ret nz
+	(0, 'pop bc', OP_NONE, 0),                       # c1 - pop bc
+	(2, 'jp nz, %s', OP_ADDR, FLOW_JUMP),            # c2 - jp nz, a16
+	(2, 'jp %s', OP_ADDR, FLOW_JUMP | FLOW_END),     # c3 - jp a16
+	(2, 'call nz, %s', OP_ADDR, FLOW_CALL),          # c4 - call nz, a16
+	(0, 'push bc', OP_NONE, 0),                      # c5 - push bc
+	(1, 'add %s', OP_D8, 0),                         # c6 - add d8
+	(0, 'rst $0', OP_NONE, 0),                       # c7 - rst $0
+	(0, 'ret z', OP_NONE, 0),                        # c8 - ret z
+	(0, 'ret', OP_NONE, FLOW_END),                   # c9 - ret
+	(2, 'jp z, %s', OP_ADDR, FLOW_JUMP),             # ca - jp z, a16
+	(1, '%s', OP_CB, 0),                             # cb - prefix
+	(2, 'call z, %s', OP_ADDR, FLOW_CALL),           # cc - call z, a16
+	(2, 'call %s', OP_ADDR, FLOW_CALL),              # cd - call a16
+	(1, 'adc %s', OP_D8, 0),                         # ce - adc d8
+	(0, 'rst $8', OP_NONE, 0),                       # cf - rst $8
+	(0, 'ret nc', OP_NONE, 0),                       # d0 - ret nc
+	(0, 'pop de', OP_NONE, 0),                       # d1 - pop de
+	(2, 'jp nc, %s', OP_ADDR, FLOW_JUMP),            # d2 - jp nc, a16
+	(0, 'db $d3', OP_NONE, 0),                       # d3 -
+	(2, 'call nc, %s', OP_ADDR, FLOW_CALL),          # d4 - call nc, a16
+	(0, 'push de', OP_NONE, 0),                      # d5 - push de
+	(1, 'sub %s', OP_D8, 0),                         # d6 - sub d8
+	(0, 'rst $10', OP_NONE, 0),                      # d7 - rst $10
+	(0, 'ret c', OP_NONE, 0),                        # d8 - ret c
+	(0, 'reti', OP_NONE, 0),                         # d9 - reti
+	(2, 'jp c, %s', OP_ADDR, FLOW_JUMP),             # da - jp c, a16
+	(0, 'db $db', OP_NONE, 0),                       # db -
+	(2, 'call c, %s', OP_ADDR, FLOW_CALL),           # dc - call c, a16
+	(0, 'db $dd', OP_NONE, 0),                       # dd -
+	(1, 'sbc %s', OP_D8, 0),                         # de - sbc d8
+	(0, 'rst $18', OP_NONE, 0),                      # df - rst $18
+	(1, 'ld [%s], a', OP_LDH, 0),                    # e0 - ld [$ff00+a8], a
+	(0, 'pop hl', OP_NONE, 0),                       # e1 - pop hl
+	(0, 'ld [$ff00+c], a', OP_NONE, 0),              # e2 - ld [$ff00+c], a
+	(0, 'db $e3', OP_NONE, 0),                       # e3 -
+	(0, 'db $e4', OP_NONE, 0),                       # e4 -
+	(0, 'push hl', OP_NONE, 0),                      # e5 - push hl
+	(1, 'and %s', OP_D8, 0),                         # e6 - and d8
+	(0, 'rst $20', OP_NONE, 0),                      # e7 - rst $20
+	(1, 'add sp, %s', OP_R8, 0),                     # e8 - add sp, r8
+	(0, 'jp hl', OP_NONE, FLOW_END),                 # e9 - jp hl
+	(2, 'ld [%s], a', OP_D16, 0),                    # ea - ld [a16], a
+	(0, 'db $eb', OP_NONE, 0),                       # eb -
+	(0, 'db $ec', OP_NONE, 0),                       # ec -
+	(0, 'db $ed', OP_NONE, 0),                       # ed -
+	(1, 'xor %s', OP_D8, 0),                         # ee - xor d8
+	(0, 'rst $28', OP_NONE, 0),                      # ef - rst $28
+	(1, 'ld a, [%s]', OP_LDH, 0),                    # f0 - ld a, [$ff00+a8]
+	(0, 'pop af', OP_NONE, 0),                       # f1 - pop af
+	(0, 'ld a, [$ff00+c]', OP_NONE, 0),              # f2 - ld a, [$ff00+c]
+	(0, 'di', OP_NONE, 0),                           # f3 - di
+	(0, 'db $f4', OP_NONE, 0),                       # f4 -
+	(0, 'push af', OP_NONE, 0),                      # f5 - push af
+	(1, 'or %s', OP_D8, 0),                          # f6 - or d8
+	(0, 'rst $30', OP_NONE, 0),                      # f7 - rst $30
+	(1, 'ld hl, sp%s', OP_SP_R8, 0),                 # f8 - ld hl, sp+r8
+	(0, 'ld sp, hl', OP_NONE, 0),                    # f9 - ld sp, hl
+	(2, 'ld a, [%s]', OP_D16, 0),                    # fa - ld a, [a16]
+	(0, 'ei', OP_NONE, 0),                           # fb - ei
+	(0, 'db $fc', OP_NONE, 0),                       # fc -
+	(0, 'db $fd', OP_NONE, 0),                       # fd -
+	(1, 'cp %s', OP_D8, 0),                          # fe - cp d8
+	(0, 'rst $38', OP_NONE, 0),                      # ff - rst $38
 ]
 
+opcode_widths = bytes(width for width, _, _, _ in opcode_table)
+opcode_flows = bytes(flow for _, _, _, flow in opcode_table)
+
+prefix_opcode_table = ['%s %s' % (op, arg)
+	for op in (['rlc', 'rrc', 'rl', 'rr', 'sla', 'sra', 'swap', 'srl'] +
+		['bit %d,' % i for i in range(8)] + ['res %d,' % i for i in range(8)] +
+		['set %d,' % i for i in range(8)])
+	for arg in ['b', 'c', 'd', 'e', 'h', 'l', '[hl]', 'a']]
 
-def disassemble(filename, entry_point=0x000000):
-	global raw_data, left_data, data_size, starting_points, operations
+def split_syntax(template):
+	# the mnemonic and the operand templates of an instruction template
+	mnemonic, _, operands = template.partition(' ')
+	return mnemonic, operands.split(', ') if operands else []
 
-	with open(filename, 'rb') as f:
-		raw_data = dict(enumerate(f.read()))
-		data_size = len(raw_data)
-		left_data = raw_data.copy()
-
-	starting_points.add(entry_point)
-
-	while starting_points:
-		pc = starting_points.pop()
-		if pc in left_data:
-			disassemble_from(pc)
-
-	pc = 0
-	LINE_LENGTH = 50
-	while pc < data_size:
-		if pc in labels:
-			for label in labels[pc]:
-				print(label + ':')
-
-		if pc in operations:
-			operation, bytes = operations[pc]
-			line = '%s%s' % (operation, ' ' * max(LINE_LENGTH - len(operation), 1))
-			print('\t%s; %s: %s' % (line, format_address(pc), format_bytes(bytes)))
-			pc += 1
-
-		elif pc in left_data:
-			chunk_pc = pc
-			CHUNK_SIZE = 8
-			data = []
-			while pc in left_data:
-				data.append(left_data[pc])
-				pc += 1
-			while data:
-				chunk, data = data[:CHUNK_SIZE], data[CHUNK_SIZE:]
-				dbs = create_db(chunk_pc, *chunk)
-				line = '%s%s' % (dbs, ' ' * max(LINE_LENGTH - len(dbs), 1))
-				print('\t%s; %s-%s' % (line, format_address(chunk_pc),
-					format_address(chunk_pc + len(chunk) - 1)))
-				chunk_pc += CHUNK_SIZE
+opcode_syntax = [split_syntax(template) for _, template, _, _ in opcode_table]
+prefix_opcode_syntax = [split_syntax(template) for template in prefix_opcode_table]
+
+# translation tables giving 1 for opcodes that are not db, for ld bc, ld de and ld hl
+# with an immediate word, which is how code loads the address of a table, for jr, jp
+# and call with a target, and for nonzero bytes
+opcode_valid = bytes(not template.startswith('db ') for _, template, _, _ in opcode_table)
+opcode_loads_pointer = bytes(opcode in (0x01, 0x11, 0x21) for opcode in range(0x100))
+opcode_branches = bytes(operand in (OP_JR, OP_ADDR) for _, _, operand, _ in opcode_table)
+opcode_ends = bytes(bool(flow & FLOW_END) for flow in opcode_flows)
+# branches and the instructions that end a basic block
+opcode_ends_block = bytes(a | b for a, b in zip(opcode_branches, opcode_ends))
+nonzero_table = bytes([0]) + bytes([1]) * 0xff
+# 0xff for nonzero bytes, to mask other bytes with
+nonzero_mask_table = bytes([0]) + bytes([0xff]) * 0xff
 
+
+class Stats:
+
+	def __init__(self):
+		self.phases = {}
+		self.instructions = 0
+		self.worklist_pushes = 0
+		self.worklist_pops = 0
+		self.worklist_peak = 0
+		self.labels_created = 0
+		self.tables_found = 0
+		self.table_targets = 0
+		self.signature_matches = 0
+		self.banks_traced = 0
+		self.banks_reused = 0
+
+	@contextmanager
+	def phase(self, name):
+		# wall and CPU time, including worker processes that finish within the phase
+		wall, cpu = time.perf_counter(), cpu_time()
+		try:
+			yield
+		finally:
+			times = self.phases.setdefault(name, [0.0, 0.0])
+			times[0] += time.perf_counter() - wall
+			times[1] += cpu_time() - cpu
+
+	def merge(self, other):
+		# counts from a worker process; labels are counted when they are merged
+		self.instructions += other.instructions
+		self.worklist_pushes += other.worklist_pushes
+		self.worklist_pops += other.worklist_pops
+		self.worklist_peak = max(self.worklist_peak, other.worklist_peak)
+
+	def as_dict(self, disassembler=None):
+		stats = {
+			'phases': {name: {'wall': wall, 'cpu': cpu}
+				for name, (wall, cpu) in self.phases.items()},
+			'instructions': self.instructions,
+			'worklist': {'pushes': self.worklist_pushes, 'pops': self.worklist_pops,
+				'peak': self.worklist_peak},
+			'labels_created': self.labels_created,
+			'tables': {'found': self.tables_found, 'targets': self.table_targets},
+			'signature_matches': self.signature_matches,
+			'banks': {'traced': self.banks_traced, 'reused': self.banks_reused},
+		}
+		if disassembler:
+			decoded = disassembler.left_data.count(0)
+			overlaps, misaligned = disassembler.conflicts()
+			stats.update({
+				'overlaps': len(overlaps),
+				'misaligned_labels': len(misaligned),
+				'rom_size': disassembler.data_size,
+				'bytes_decoded': decoded,
+				'bytes_data': disassembler.data_size - decoded,
+				'labels': len(disassembler.labels),
+			})
+		return stats
+
+	def report(self, disassembler=None, file=None):
+		stats = self.as_dict(disassembler)
+		file = file or sys.stderr
+		for name, times in stats['phases'].items():
+			print('%-12s %9.3fs wall %9.3fs cpu' % (name, times['wall'], times['cpu']), file=file)
+		print('instructions %10d decoded' % stats['instructions'], file=file)
+		print('worklist     %10d pushes %10d pops %10d peak' % (stats['worklist']['pushes'],
+			stats['worklist']['pops'], stats['worklist']['peak']), file=file)
+		print('tables       %10d found %11d targets' % (stats['tables']['found'],
+			stats['tables']['targets']), file=file)
+		print('signatures   %10d matched' % stats['signature_matches'], file=file)
+		print('banks        %10d traced %10d reused' % (stats['banks']['traced'],
+			stats['banks']['reused']), file=file)
+		print('labels       %10d created' % stats['labels_created'], end='', file=file)
+		if disassembler:
+			print(' %10d total' % stats['labels'], file=file)
+			print('bytes        %10d decoded %9d data (%.1f%% decoded)' % (
+				stats['bytes_decoded'], stats['bytes_data'],
+				100 * stats['bytes_decoded'] / max(stats['rom_size'], 1)), file=file)
+			print('conflicts    %10d overlaps %8d labels inside instructions' % (
+				stats['overlaps'], stats['misaligned_labels']), file=file)
 		else:
-			pc += 1
+			print(file=file)
+
+def cpu_time():
+	times = os.times()
+	return times.user + times.system + times.children_user + times.children_system
+
+
+class Disassembler:
+
+	def __init__(self, rom):
+		self.stats = Stats()
+		self.filename = None
+		if isinstance(rom, str):
+			self.filename = rom
+			with self.stats.phase('load'):
+				rom = load_rom(rom)
+		self.raw_data = memoryview(rom)
+		self.data_size = len(self.raw_data)
+		self.num_banks = -(-self.data_size // BANK_SIZE)
+		# one byte per ROM byte, nonzero while it is still undecoded
+		self.left_data = bytearray(b'\x01') * self.data_size
+		self.starting_points = set()
+		self.labels = defaultdict(set)
+		self.ram_labels = defaultdict(set)
+		# the length of the instruction at each ROM address, or 0 if none begins there
+		self.lengths = bytearray(self.data_size)
+		# write addresses without labels as the nearest label plus an offset
+		self.nearest_labels = False
+		self.label_indexes = {}
+		self.graph = None
+
+	def add_labels(self, labels, ram_labels=None):
+		for address, names in labels.items():
+			self.labels[address].update(names)
+		self.starting_points.update(labels.keys())
+		for address, names in (ram_labels or {}).items():
+			self.ram_labels[address].update(names)
+
+	def num_instructions(self):
+		return self.data_size - self.lengths.count(0)
+
+	def instruction_addresses(self, start=0, end=None):
+		end = self.data_size if end is None else end
+		return compress(range(start, end), self.lengths[start:end])
+
+	def opcode_addresses(self, table, start=0, end=None):
+		# the instructions whose opcode the translation table gives 1, found with masks
+		# of the whole range as big integers, combined a machine word at a time
+		end = self.data_size if end is None else end
+		return compress(range(start, end), (
+			int.from_bytes(bytes(self.raw_data[start:end]).translate(table), 'little') &
+			int.from_bytes(self.lengths[start:end].translate(nonzero_table), 'little')
+			).to_bytes(end - start, 'little'))
+
+	def branch_addresses(self, start=0, end=None):
+		# jr, jp and call with a target
+		return self.opcode_addresses(opcode_branches, start, end)
+
+	def is_flat(self):
+		# ROMs without switchable banks are traced as one 32 KB address space
+		return self.num_banks <= 2
 
+	def resolve_target(self, pc, target):
+		# map a $0000-$ffff target seen by the CPU at ROM address pc
+		# to a ROM address, or None if it is not in a known ROM bank
+		if 0 <= target < BANK_SIZE:
+			return target
+		if BANK_SIZE <= target < 2 * BANK_SIZE:
+			bank = address_to_bank(pc)
+			if not bank:
+				if not self.is_flat():
+					return None
+				bank = 1
+			return bank * BANK_SIZE + target - BANK_SIZE
+		return None
 
-def disassemble_from(pc):
-	global raw_data, left_data, operations, terminate
+	def bank_limit(self, pc):
+		# code cannot run past the end of a switchable bank
+		if self.is_flat():
+			return self.data_size
+		return min((address_to_bank(pc) + 1) * BANK_SIZE, self.data_size)
 
-	terminate = False
+	def branch_target(self, pc):
+		# the $0000-$ffff target of the jr, jp or call at ROM address pc
+		raw_data = self.raw_data
+		if opcode_table[raw_data[pc]][2] == OP_JR:
+			return address_to_offset(pc) + 2 + signed(raw_data[pc + 1])
+		return raw_data[pc + 2] << 8 | raw_data[pc + 1]
 
-	while pc < data_size:
-		if pc not in left_data:
+	def create_branch(self, pc):
+		address = self.resolve_target(pc, self.branch_target(pc))
+		if address is not None:
+			self.starting_points.add(address)
+			self.stats.worklist_pushes += 1
+			if address not in self.labels:
+				self.labels[address].add(format_label(address))
+				self.stats.labels_created += 1
+
+	def target_label(self, pc, target):
+		address = self.resolve_target(pc, target)
+		labels = self.labels
+		if address is None:
+			labels = self.ram_labels
+		else:
+			target = address
+		names = labels.get(target)
+		if names and not (self.nearest_labels and is_generated_label(target, names)):
+			return primary_label(names)
+		if self.nearest_labels:
+			# a nearby label from the sym file says more than a generated one
+			label = self.nearest_label(labels, target)
+			if label:
+				return label
+		return primary_label(names) if names else format_label(target)
+
+	def label_index(self, labels, generated=True):
+		# rebuilt when labels have been added or replaced since
+		key = id(labels), generated
+		cached = self.label_indexes.get(key)
+		if not cached or cached[0] is not labels or cached[1] != len(labels):
+			cached = self.label_indexes[key] = (labels, len(labels),
+				LabelIndex(labels, generated))
+		return cached[2]
+
+	def nearest_label(self, labels, target):
+		# e.g. Label+$12, for a label other than a generated one shortly before target
+		# in the same ROM bank
+		address, name = self.label_index(labels, generated=False).nearest(target)
+		if address is None or target - address > NEAREST_LABEL_DISTANCE:
+			return None
+		if labels is self.labels and address_to_bank(address) != address_to_bank(target):
+			return None
+		return '%s+$%x' % (name, target - address)
+
+	def trace(self, entry_point=0x000000):
+		self.starting_points.add(entry_point)
+		self.trace_bank()
+		return self.lengths
+
+	def trace_bank(self, bank=None):
+		# follow the worklist, deferring starting points outside the given bank
+		outgoing = set()
+		starting_points, stats = self.starting_points, self.stats
+		if bank is None:
+			start, end = 0, self.data_size
+		else:
+			start, end = bank * BANK_SIZE, self.bank_limit(bank * BANK_SIZE)
+		num_instructions = self.lengths.count(0, start, end)
+
+		while starting_points:
+			stats.worklist_peak = max(stats.worklist_peak, len(starting_points))
+			pc = starting_points.pop()
+			stats.worklist_pops += 1
+			if not (0 <= pc < self.data_size and self.left_data[pc]):
+				continue
+			if bank is not None and address_to_bank(pc) != bank:
+				outgoing.add(pc)
+				continue
+			self.disassemble_from(pc)
+
+		stats.instructions += num_instructions - self.lengths.count(0, start, end)
+		return outgoing
+
+	def trace_parallel(self, entry_point=0x000000, jobs=None):
+		self.starting_points.add(entry_point)
+		if self.is_flat():
+			self.trace_bank()
+			return self.lengths
+
+		pending = defaultdict(set)
+		for pc in self.starting_points:
+			if 0 <= pc < self.data_size:
+				pending[address_to_bank(pc)].add(pc)
+		self.starting_points.clear()
+
+		rom = self.filename or bytes(self.raw_data)
+		with ProcessPoolExecutor(jobs, initializer=_init_bank_worker,
+			initargs=(rom, dict(self.labels), dict(self.ram_labels))) as executor:
+			while pending:
+				futures = []
+				for bank, entries in sorted(pending.items()):
+					start, end = bank * BANK_SIZE, self.bank_limit(bank * BANK_SIZE)
+					futures.append(executor.submit(_trace_bank_worker, bank, entries,
+						bytes(self.left_data[start:end]), bytes(self.lengths[start:end])))
+				pending.clear()
+				for future in futures:
+					bank, left_data, lengths, new_labels, outgoing, stats = future.result()
+					start = bank * BANK_SIZE
+					self.left_data[start:start + len(left_data)] = left_data
+					self.lengths[start:start + len(lengths)] = lengths
+					self.stats.merge(stats)
+					for address in new_labels:
+						if address not in self.labels:
+							self.labels[address].add(format_label(address))
+							self.stats.labels_created += 1
+					for pc in outgoing:
+						pending[address_to_bank(pc)].add(pc)
+				# a bank may have been traced from another entry in the meantime
+				for bank, entries in list(pending.items()):
+					entries = {pc for pc in entries if self.left_data[pc]}
+					if entries:
+						pending[bank] = entries
+					else:
+						del pending[bank]
+
+		return self.lengths
+
+	def trace_tables(self, passes=TABLE_PASSES):
+		# trace the code that pointer tables point at, until no more is found
+		for _ in range(passes):
+			targets = self.table_targets()
+			if not targets:
+				break
+			for address in targets:
+				if address not in self.labels:
+					self.labels[address].add(format_label(address))
+					self.stats.labels_created += 1
+			self.stats.table_targets += len(targets)
+			self.starting_points.update(targets)
+			self.trace_bank()
+		return self.lengths
+
+	def table_targets(self):
+		# the undecoded ROM addresses that pointer tables among the data point at:
+		# runs of little-endian words that each point at a routine entry or at what looks
+		# like a routine, either loaded by the code or long and mostly pointing at entries
+		raw_data, left_data, lengths, labels = self.raw_data, self.left_data, self.lengths, \
+			self.labels
+		size = self.data_size
+		opcodes = bytes(raw_data)
+		instructions = int.from_bytes(lengths.translate(nonzero_table), 'little')
+		labelled = bytearray(size)
+		for address in labels:
+			if address < size:
+				labelled[address] = 1
+		# whole-ROM masks as big integers, combined a machine word at a time: 2 where a
+		# labelled instruction begins and 1 for a valid opcode not yet decoded
+		entries = instructions & int.from_bytes(labelled, 'little')
+		landing = ((int.from_bytes(opcodes.translate(opcode_valid), 'little') &
+			int.from_bytes(left_data, 'little')) | entries << 1).to_bytes(size, 'little')
+		undecoded = left_data.translate(nonzero_mask_table)
+		referenced = sorted({address for address in (self.resolve_target(pc,
+			raw_data[pc + 2] << 8 | raw_data[pc + 1])
+			for pc in self.opcode_addresses(opcode_loads_pointer) if lengths[pc] == 3)
+			if address is not None})
+
+		targets = set()
+		for start, stop in self.regions():
+			# whether each $0000-$ffff address seen from this bank could be branched to
+			landings = landing[:BANK_SIZE].ljust(BANK_SIZE, b'\0')
+			switchable = self.resolve_target(start, BANK_SIZE)
+			if switchable is not None:
+				landings += landing[switchable:switchable + BANK_SIZE]
+			landings = bytes(TABLE_MIN_POINTER) + landings[TABLE_MIN_POINTER:].ljust(
+				0x10000 - TABLE_MIN_POINTER, b'\0')
+
+			for first in (start, start + 1):
+				count = (stop - first) // 2
+				if count < TABLE_MIN_ENTRIES:
+					continue
+				end = first + 2 * count
+				words = array('H')
+				words.frombytes(raw_data[first:end])
+				if sys.byteorder != 'little':
+					words.byteswap()
+				# words that could be pointers, with both of their bytes undecoded
+				flags = (int.from_bytes(bytes(map(landings.__getitem__, words)), 'little') &
+					int.from_bytes(undecoded[first:end:2], 'little') &
+					int.from_bytes(undecoded[first + 1:end:2], 'little')).to_bytes(count, 'little')
+				for match in TABLE_PATTERN.finditer(flags):
+					i, j = match.span()
+					# a table that the code loads starts where it is loaded
+					k = bisect_left(referenced, first + 2 * i)
+					while k < len(referenced) and referenced[k] < first + 2 * j and (
+						referenced[k] - first) % 2:
+						k += 1
+					loaded = k < len(referenced) and referenced[k] < first + 2 * j
+					if loaded:
+						i = (referenced[k] - first) // 2
+					elif j - i < TABLE_MIN_UNLOADED_ENTRIES or 2 * flags.count(2, i, j) < (
+						TABLE_MIN_UNLOADED_ENTRIES):
+						# too short, or too few pointers at routine entries, however long
+						# the table turns out
+						continue
+					table = []
+					for word in words[i:j]:
+						address = self.resolve_target(first + 2 * i, word)
+						if not self.looks_like_code(address):
+							break
+						table.append(address)
+					if len(set(table)) < (TABLE_MIN_ENTRIES if loaded else
+						TABLE_MIN_UNLOADED_ENTRIES):
+						continue
+					if not loaded and 2 * sum(address in labels and lengths[address] > 0
+						for address in table) < len(table):
+						continue
+					new_targets = {address for address in table if left_data[address]}
+					if new_targets:
+						targets.update(new_targets)
+						self.stats.tables_found += 1
+		return targets
+
+	def looks_like_code(self, pc):
+		# whether pc is a routine entry, or decoding from it soon reaches the end of a
+		# routine or falls into one, without an invalid opcode or what looks like padding
+		raw_data, left_data, lengths, labels = self.raw_data, self.left_data, self.lengths, \
+			self.labels
+		limit = self.bank_limit(pc)
+		previous = None
+		for _ in range(TABLE_MAX_INSTRUCTIONS):
+			if pc >= limit:
+				return False
+			if not left_data[pc]:
+				return lengths[pc] > 0 and pc in labels
+			opcode = raw_data[pc]
+			if not opcode_valid[opcode] or opcode == 0xff or opcode == previous == 0x00:
+				return False
+			if opcode_flows[opcode] & FLOW_END:
+				return True
+			previous = opcode
+			pc += 1 + opcode_widths[opcode]
+		return False
+
+	def trace_shared(self, store, entry_point=0x000000):
+		# trace region by region, reusing the traces of regions with the same contents
+		# and entries from the store; only the targets of branches out of a region are
+		# resolved again for this ROM
+		self.starting_points.add(entry_point)
+		regions = self.regions()
+		entries = defaultdict(set)
+		pending = defaultdict(set)
+		for pc in self.starting_points:
+			if 0 <= pc < self.data_size:
+				pending[self.region_index(pc)].add(pc)
+		self.starting_points.clear()
+
+		while pending:
+			outgoing = set()
+			for index, new_entries in sorted(pending.items()):
+				start, end = regions[index]
+				entries[index] |= new_entries
+				kind = 'flat' if self.is_flat() else 'home' if index == 0 else 'bank'
+				key = store.key(self.raw_data[start:end], kind,
+					[address_to_offset(pc) for pc in entries[index]])
+				analysis = store.load(key, end - start)
+				if analysis:
+					self.stats.banks_reused += 1
+					self.lengths[start:end], self.left_data[start:end], targets = analysis
+				else:
+					self.stats.banks_traced += 1
+					targets = self.trace_region(start, end, entries[index])
+					store.save(key, self.lengths[start:end], self.left_data[start:end], targets)
+				for target in targets:
+					address = self.resolve_target(start, target)
+					if address is None or address >= self.data_size:
+						continue
+					if address not in self.labels:
+						self.labels[address].add(format_label(address))
+						self.stats.labels_created += 1
+					if not start <= address < end:
+						outgoing.add(address)
+			pending.clear()
+			# a region is traced again from scratch when it is entered somewhere new
+			for pc in outgoing:
+				index = self.region_index(pc)
+				if self.left_data[pc] and pc not in entries[index]:
+					pending[index].add(pc)
+		return self.lengths
+
+	def trace_region(self, start, end, entries):
+		# trace a region from scratch, returning the $0000-$ffff targets of its branches
+		self.lengths[start:end] = bytes(end - start)
+		self.left_data[start:end] = b'\x01' * (end - start)
+		# a fresh worklist, so that the trace depends only on the region and its entries
+		self.starting_points = set(sorted(entries))
+		self.trace_bank(None if self.is_flat() else address_to_bank(start))
+		self.starting_points.clear()
+		raw_data, lengths = self.raw_data, self.lengths
+		targets = {self.branch_target(pc) for pc in self.branch_addresses(start, end)
+			if lengths[pc] == 1 + opcode_widths[raw_data[pc]]}
+		# a jr near the start of the ROM can branch before it
+		return array('H', sorted(target for target in targets if 0 <= target <= 0xffff))
+
+	def disassemble_from(self, pc):
+		raw_data, left_data, lengths = self.raw_data, self.left_data, self.lengths
+		limit = self.bank_limit(pc)
+
+		while pc < limit:
+			if not left_data[pc]:
+				return
+			opcode = raw_data[pc]
+			end = pc + 1 + opcode_widths[opcode]
+
+			if end > limit:
+				# truncated by the end of the ROM or bank; rendered as data
+				lengths[pc] = limit - pc
+				left_data[pc:limit] = bytes(limit - pc)
+				return
+
+			lengths[pc] = end - pc
+			left_data[pc:end] = bytes(end - pc)
+
+			flow = opcode_flows[opcode]
+			if flow:
+				if flow & (FLOW_JUMP | FLOW_CALL):
+					self.create_branch(pc)
+				if flow & FLOW_END:
+					return
+
+			pc = end
+
+	def format_operation(self, pc, length):
+		raw_data = self.raw_data
+		opcode = raw_data[pc]
+		width, template, operand, _ = opcode_table[opcode]
+		if length != width + 1:
+			return create_db(pc, *raw_data[pc:pc + length])
+		if operand == OP_NONE:
+			return template
+		if operand == OP_CB:
+			return prefix_opcode_table[raw_data[pc + 1]]
+		return template % self.format_operand(pc, operand)
+
+	def format_operand(self, pc, operand):
+		raw_data = self.raw_data
+		if operand == OP_D8:
+			return u8(raw_data[pc + 1])
+		if operand == OP_D16:
+			return u16le(raw_data[pc + 1], raw_data[pc + 2])
+		if operand == OP_JR or operand == OP_ADDR:
+			return self.target_label(pc, self.branch_target(pc))
+		if operand == OP_LDH:
+			return format_hardware_register(raw_data[pc + 1])
+		return s8(raw_data[pc + 1], plus=operand == OP_SP_R8)
+
+	def records(self, start=0, end=None):
+		# yield a dict for each instruction, each run of data bytes within a bank, and
+		# each label inside an instruction, without formatting lines
+		lengths, labels, left_data = self.lengths, self.labels, self.left_data
+		end = self.data_size if end is None else min(end, self.data_size)
+		if start >= end:
 			return
-		opcode = left_data[pc]
-		width, get_operation = opcode_table[opcode]
+		points = set(self.instruction_addresses(start, end))
+		points.update(address for address in labels if start <= address < end)
+		points.add(start)
+		points = sorted(points)
+		points.append(end)
 
-		if pc + width < data_size:
-			args = [raw_data[pc + 1 + i] for i in range(width)]
-			operations[pc] = (get_operation(pc, *args), [opcode] + args)
+		for point, following in zip(points, islice(points, 1, None)):
+			names = labels.get(point)
+			names = sorted(names, key=label_order) if names else []
+			if lengths[point]:
+				yield self.instruction_record(point, lengths[point], names)
+				names = []
+			elif names and not left_data[point]:
+				yield {'type': 'label', 'address': point, 'bank': address_to_bank(point),
+					'labels': names}
+				names = []
+			# labels within a run of data begin a new record
+			pc = left_data.find(1, point, following)
+			while pc >= 0:
+				stop = left_data.find(0, pc, following)
+				if stop < 0:
+					stop = following
+				while pc < stop:
+					split = min(stop, (address_to_bank(pc) + 1) * BANK_SIZE)
+					yield {'type': 'data', 'address': pc, 'bank': address_to_bank(pc),
+						'bytes': bytes(self.raw_data[pc:split]),
+						'labels': names if pc == point else []}
+					pc = split
+				pc = left_data.find(1, stop, following)
+
+	def instruction_record(self, pc, length, names):
+		raw_data = self.raw_data
+		opcode = raw_data[pc]
+		width, _, operand, flow = opcode_table[opcode]
+		target = None
+		if length != width + 1:
+			# truncated by the end of the ROM or bank
+			mnemonic, operands = 'db', [u8(b) for b in raw_data[pc:pc + length]]
+		elif operand == OP_CB:
+			mnemonic, operands = prefix_opcode_syntax[raw_data[pc + 1]]
 		else:
-			bytes = [raw_data[a] for a in range(pc, data_size)]
-			operations[pc] = (create_db(pc, *bytes), bytes)
+			mnemonic, operands = opcode_syntax[opcode]
+			if operand != OP_NONE:
+				value = self.format_operand(pc, operand)
+				operands = [template % value if '%' in template else template
+					for template in operands]
+				if operand == OP_JR or (operand == OP_ADDR and flow):
+					target = self.resolve_target(pc, self.branch_target(pc))
+		return {'type': 'instruction', 'address': pc, 'bank': address_to_bank(pc),
+			'bytes': bytes(raw_data[pc:pc + length]), 'mnemonic': mnemonic,
+			'operands': operands, 'target': target, 'labels': names}
+
+	def write_records(self, output, output_format='jsonl', start=0, end=None):
+		# JSON lines to a text file, or binary records to a binary file
+		if isinstance(output, str):
+			mode = 'wb' if output_format == 'binary' else 'w'
+			with open(output, mode, buffering=WRITE_BUFFER_SIZE) as f:
+				self.write_records(f, output_format, start, end)
+			return
+		encode = encode_record if output_format == 'binary' else encode_json_record
+		records = self.records(self.line_start(start), end)
+		while True:
+			batch = [encode(record) for record in islice(records, WRITE_BATCH_LINES)]
+			if not batch:
+				break
+			output.write(type(batch[0])().join(batch))
+
+	def render(self, start=0, end=None):
+		# yield the lines for labels, instructions and data lines beginning in [start, end)
+		raw_data, left_data, data_size = self.raw_data, self.left_data, self.data_size
+		labels, lengths = self.labels, self.lengths
+		end = data_size if end is None else min(end, data_size)
+
+		pc = start
+		if 0 < pc < end and left_data[pc] and left_data[pc - 1]:
+			# starting inside a run of data, whose lines are aligned to the start of the run
+			run_start = left_data.rfind(0, 0, pc) + 1
+			yield from self.render_data(run_start,
+				run_start + -(-(pc - run_start) // CHUNK_SIZE) * CHUNK_SIZE, end)
+			pc = self.data_run_end(pc)
+
+		# visit only the instructions, labels and runs of data, in address order
+		points = list(self.instruction_addresses(pc, end))
+		label_addresses = self.label_index(labels).addresses
+		points.extend(label_addresses[
+			bisect_left(label_addresses, pc):bisect_left(label_addresses, end)])
+		# merges the two sorted runs
+		points.sort()
+		data = left_data.find(1, pc, end)
+
+		for point in points:
+			# labels inside runs of data are not shown
+			while 0 <= data < point:
+				yield from self.render_data(data, data, end)
+				pc = self.data_run_end(data)
+				data = left_data.find(1, pc, end)
+			if point < pc:
+				continue
+
+			if point in labels:
+				for label in sorted(labels[point], key=label_order):
+					yield label + ':'
+
+			length = lengths[point]
+			if length:
+				# the operation padded to LINE_LENGTH with at least one space
+				yield '\t%-*s ; %06x: %s' % (LINE_LENGTH - 1, self.format_operation(point, length),
+					point, raw_data[point:point + length].hex(' '))
+				pc = point + 1
+
+			elif left_data[point]:
+				yield from self.render_data(point, point, end)
+				pc = self.data_run_end(point)
+				data = left_data.find(1, pc, end)
+
+			else:
+				pc = point + 1
+
+		while data >= 0:
+			yield from self.render_data(data, data, end)
+			data = left_data.find(1, self.data_run_end(data), end)
+
+	def conflicts(self):
+		# (address, instruction) pairs for instructions that begin inside another
+		# instruction, and for labels, such as branch targets, inside an instruction
+		lengths, left_data = self.lengths, self.left_data
+		overlaps = []
+		for match in OVERLAP_PATTERN.finditer(lengths):
+			pc = match.start()
+			overlaps.extend((other, pc) for other in range(pc + 1, pc + lengths[pc])
+				if lengths[other])
+		misaligned = [(address, self.instruction_start(address))
+			for address in sorted(self.labels) if address < self.data_size
+			and not left_data[address] and not lengths[address] and self.labels[address]]
+		return overlaps, misaligned
+
+	def flow_graph(self):
+		# rebuilt when code or labels have been added since
+		key = (self.num_instructions(), len(self.labels))
+		if not self.graph or self.graph[0] != key:
+			self.graph = key, FlowGraph(self)
+		return self.graph[1]
+
+	def routines(self):
+		# (start, end, name, digest) for each run of instructions from a global label up
+		# to the next one or to data, hashed with the targets of branches masked, so
+		# that code which only moved elsewhere keeps its hash, as does code calling it
+		raw_data, left_data, lengths, labels = self.raw_data, self.left_data, self.lengths, \
+			self.labels
+		size = self.data_size
+		masked = bytearray(raw_data)
+		for pc in self.branch_addresses():
+			masked[pc + 1:pc + lengths[pc]] = bytes(lengths[pc] - 1)
+
+		index = self.label_index(labels)
+		starts = [address for address, name in zip(index.addresses, index.names)
+			if address < size and lengths[address] and '.' not in name]
+		routines = []
+		for start, next_start in zip(starts, starts[1:] + [size]):
+			end = min(next_start, self.bank_limit(start))
+			data = left_data.find(1, start, end)
+			if data >= 0:
+				end = data
+			routines.append((start, end, primary_label(labels[start]),
+				hashlib.blake2b(masked[start:end], digest_size=16).digest()))
+		return routines
+
+	def data_run_end(self, pc):
+		pc = self.left_data.find(0, pc)
+		return self.data_size if pc < 0 else pc
+
+	def render_data(self, run_start, pc, end):
+		# the lines of the data run from run_start that begin in [pc, end)
+		stop = self.data_run_end(run_start)
+		if stop > end:
+			stop = min(run_start + -(-(end - run_start) // CHUNK_SIZE) * CHUNK_SIZE, stop)
+		if pc < stop:
+			yield from format_data(self.raw_data[pc:stop], pc)
 
-		for i in range(pc, min(pc + 1 + width, data_size)):
-			if i in left_data:
-				del left_data[i]
+	def write(self, output, start=0, end=None):
+		if isinstance(output, str):
+			with open(output, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+				self.write(f, start, end)
+			return
+		lines = self.render(self.line_start(start), end)
+		while True:
+			batch = list(islice(lines, WRITE_BATCH_LINES))
+			if not batch:
+				break
+			batch.append('')
+			output.write('\n'.join(batch))
+
+	def write_parallel(self, output, jobs=None, start=0, end=None):
+		# the same as write, with chunks of the listing rendered in worker processes
+		if isinstance(output, str):
+			with open(output, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+				self.write_parallel(f, jobs, start, end)
+			return
+		start = self.line_start(start)
+		end = self.data_size if end is None else min(end, self.data_size)
+		bounds = [start] + [self.line_start(pc) for pc in range(
+			start - start % RENDER_CHUNK_SIZE + RENDER_CHUNK_SIZE, end, RENDER_CHUNK_SIZE)]
+		if len(bounds) == 1 or jobs == 1:
+			self.write(output, start, end)
+			return
+		output.writelines(render_parallel(self, zip(bounds, bounds[1:] + [end]), jobs))
+
+	def encode_analysis(self):
+		labels = encode_labels(self.labels)
+		ram_labels = encode_labels(self.ram_labels)
+		header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, self.data_size,
+			len(labels), len(ram_labels))
+		return header + zlib.compress(b''.join([self.lengths, self.left_data,
+			labels, ram_labels]), 1)
+
+	def decode_analysis(self, data):
+		try:
+			(magic, version, data_size, labels_size,
+				ram_labels_size) = CACHE_HEADER.unpack_from(data)
+			if (magic, version, data_size) != (CACHE_MAGIC, CACHE_VERSION, self.data_size):
+				return False
+			payload = memoryview(zlib.decompress(data[CACHE_HEADER.size:]))
+		except (struct.error, zlib.error):
+			return False
+
+		self.lengths = bytearray(payload[:data_size])
+		self.left_data = bytearray(payload[data_size:2 * data_size])
+		end = 2 * data_size
+		self.labels = decode_labels(payload[end:end + labels_size])
+		end += labels_size
+		self.ram_labels = decode_labels(payload[end:end + ram_labels_size])
+		self.starting_points.clear()
+		return True
+
+	def save_analysis(self, filename):
+		write_atomically(filename, self.encode_analysis())
 
-		if terminate:
+	def load_analysis(self, filename):
+		try:
+			with open(filename, 'rb') as f:
+				data = f.read()
+		except OSError:
+			return False
+		return self.decode_analysis(data)
+
+	def save_window_index(self, filename):
+		# the analysis uncompressed, with labels sorted by address, so that a window
+		# can be rendered without decoding the rest of it
+		label_addresses, label_offsets, label_names = encode_label_index(self.labels)
+		ram_addresses, ram_offsets, ram_names = encode_label_index(self.ram_labels)
+		arrays = [label_addresses, label_offsets, ram_addresses, ram_offsets]
+		if sys.byteorder != 'little':
+			for values in arrays:
+				values.byteswap()
+		header = WINDOW_HEADER.pack(WINDOW_MAGIC, CACHE_VERSION, self.data_size,
+			len(label_addresses), len(ram_addresses))
+		write_atomically(filename, b''.join([header] + [values.tobytes() for values in arrays] +
+			[self.lengths, self.left_data, label_names, ram_names]))
+
+	def load_window(self, filename, start, end):
+		# load only the instructions and labels that rendering [start, end) needs
+		if sys.byteorder != 'little':
+			# the index is mapped as it is, and stored little-endian
+			return False
+		try:
+			index = load_rom(filename)
+			(magic, version, data_size, num_labels,
+				num_ram_labels) = WINDOW_HEADER.unpack_from(index)
+		except (OSError, struct.error):
+			return False
+		if (magic, version, data_size) != (WINDOW_MAGIC, CACHE_VERSION, self.data_size):
+			return False
+
+		sections = []
+		pos = WINDOW_HEADER.size
+		for size in [num_labels, num_labels + 1, num_ram_labels, num_ram_labels + 1]:
+			if len(index) < pos + size * 4:
+				return False
+			sections.append(index[pos:pos + size * 4].cast(UINT32_TYPECODE))
+			pos += size * 4
+		label_addresses, label_offsets, ram_addresses, ram_offsets = sections
+		lengths = index[pos:pos + data_size]
+		pos += data_size
+		left_data = index[pos:pos + data_size]
+		pos += data_size
+		label_names = index[pos:pos + label_offsets[-1]]
+		pos += label_offsets[-1]
+		ram_names = index[pos:pos + ram_offsets[-1]]
+		if len(index) < pos + ram_offsets[-1]:
+			return False
+
+		self.lengths = bytearray(lengths)
+		self.left_data = bytearray(left_data)
+		self.labels = defaultdict(set)
+		self.ram_labels = defaultdict(set)
+		self.starting_points.clear()
+
+		label_index = (label_addresses, label_offsets, label_names)
+		ram_label_index = (ram_addresses, ram_offsets, ram_names)
+		start = self.line_start(start)
+		for i in range(bisect_left(label_addresses, start), bisect_left(label_addresses, end)):
+			self.labels[label_addresses[i]].update(label_index_names(label_index, i))
+		for pc in self.instruction_addresses(start, min(end, self.data_size)):
+			width, _, operand, _ = opcode_table[self.raw_data[pc]]
+			if self.lengths[pc] != width + 1 or (operand != OP_JR and operand != OP_ADDR):
+				continue
+			target = self.branch_target(pc)
+			address = self.resolve_target(pc, target)
+			if address is None:
+				self.load_indexed_label(self.ram_labels, ram_label_index, target)
+			else:
+				self.load_indexed_label(self.labels, label_index, address)
+		return True
+
+	def load_indexed_label(self, labels, label_index, address):
+		# the names at address, and the nearest ones before it that -n could use instead
+		addresses = label_index[0]
+		i = bisect_right(addresses, address) - 1
+		if i >= 0 and addresses[i] == address:
+			names = label_index_names(label_index, i)
+			labels[address].update(names)
+			if not is_generated_label(address, names):
+				return
+			i -= 1
+		if not self.nearest_labels:
 			return
+		while i >= 0 and address - addresses[i] <= NEAREST_LABEL_DISTANCE:
+			names = label_index_names(label_index, i)
+			if not is_generated_label(addresses[i], names):
+				labels[addresses[i]].update(names)
+				return
+			i -= 1
+
+	def instruction_start(self, pc):
+		# the start of the instruction that covers pc
+		if 0 < pc < self.data_size and not self.left_data[pc] and not self.lengths[pc]:
+			for offset in (1, 2):
+				if pc >= offset and self.lengths[pc - offset] > offset:
+					return pc - offset
+		return pc
+
+	def line_start(self, pc):
+		# the start of the line that covers pc: its instruction, or its line of data
+		left_data = self.left_data
+		if 0 < pc < self.data_size and left_data[pc] and left_data[pc - 1]:
+			run_start = left_data.rfind(0, 0, pc) + 1
+			return pc - (pc - run_start) % CHUNK_SIZE
+		return self.instruction_start(pc)
 
-		pc += 1 + width
+	def regions(self):
+		# the address ranges that are rendered and reused independently
+		if self.is_flat():
+			return [(0, self.data_size)]
+		return [(start, min(start + BANK_SIZE, self.data_size))
+			for start in range(0, self.data_size, BANK_SIZE)]
 
+	def region_index(self, address):
+		return 0 if self.is_flat() else address_to_bank(address)
 
-def create_ldh_to(a):
-	return 'ld [%s], a' % gbhw_register_table.get(a, '$ff00+' + u8(a))
+	def retrace(self, changed, labels, ram_labels, entry_point=0x000000):
+		# update a previous analysis after the ROM bytes in the changed ranges
+		# were modified, starting over from the current labels
+		lengths, left_data = self.lengths, self.left_data
+		for start, end in changed:
+			# instructions are at most three bytes long
+			for pc in range(max(start - 2, 0), end):
+				length = lengths[pc]
+				if length and pc + length > start:
+					lengths[pc] = 0
+					left_data[pc:pc + length] = b'\x01' * length
 
-def create_ldh_from(a):
-	return 'ld a, [%s]' % gbhw_register_table.get(a, '$ff00+' + u8(a))
+		self.labels = defaultdict(set)
+		self.ram_labels = defaultdict(set)
+		self.starting_points.clear()
+		self.add_labels(labels, ram_labels)
+		self.labels[entry_point].add('ENTRY_POINT')
+		self.starting_points.add(entry_point)
+		roots = list(self.starting_points)
+		self.starting_points.clear()
+
+		self.collect_garbage(roots)
+		self.trace_bank()
+
+	def collect_garbage(self, roots):
+		# keep the instructions reachable from the roots and label their branch
+		# targets, then queue the undecoded bytes they lead to for tracing
+		raw_data, left_data, data_size = self.raw_data, self.left_data, self.data_size
+		lengths, labels = self.lengths, self.labels
+
+		flat = self.is_flat()
+		reachable = bytearray(data_size)
+		stopped = []
+		stack = roots
+		while stack:
+			pc = stack.pop()
+			if not 0 <= pc < data_size or reachable[pc]:
+				continue
+			length = lengths[pc]
+			if not length:
+				if left_data[pc]:
+					self.starting_points.add(pc)
+				else:
+					stopped.append(pc)
+				continue
+			reachable[pc] = 1
+			opcode = raw_data[pc]
+			if length != opcode_widths[opcode] + 1:
+				continue
+			flow = opcode_flows[opcode]
+			if flow & (FLOW_JUMP | FLOW_CALL):
+				address = self.resolve_target(pc, self.branch_target(pc))
+				if address is not None:
+					if address not in labels:
+						labels[address].add(format_label(address))
+					stack.append(address)
+			if not flow & FLOW_END:
+				pc += length
+				if pc < data_size and (flat or pc % BANK_SIZE):
+					stack.append(pc)
+
+		for pc in list(self.instruction_addresses()):
+			if not reachable[pc]:
+				length = lengths[pc]
+				lengths[pc] = 0
+				left_data[pc:pc + length] = b'\x01' * length
+		# tracing stopped inside instructions that have just been removed
+		self.starting_points.update(pc for pc in stopped if left_data[pc])
+
+	def changed_regions(self, changed, lengths, labels, ram_labels):
+		# the indexes of regions whose rendering may differ from the previous analysis
+		regions = set()
+		for start, end in changed:
+			regions.update(range(self.region_index(start), self.region_index(end - 1) + 1))
+		regions.update(index for index, (start, end) in enumerate(self.regions())
+			if lengths[start:end] != self.lengths[start:end])
+
+		relabelled = {address for address in labels.keys() | self.labels.keys()
+			if labels.get(address) != self.labels.get(address)}
+		regions.update(self.region_index(address) for address in relabelled
+			if address < self.data_size)
+		if ram_labels != self.ram_labels:
+			return set(range(len(self.regions())))
+		if relabelled:
+			# instructions elsewhere that refer to the relabelled addresses, or with -n,
+			# to addresses that may now be written relative to one of them
+			raw_data, lengths = self.raw_data, self.lengths
+			distance = NEAREST_LABEL_DISTANCE if self.nearest_labels else 0
+			relabelled = sorted(relabelled)
+			for pc in self.instruction_addresses():
+				opcode = raw_data[pc]
+				if (opcode_flows[opcode] & (FLOW_JUMP | FLOW_CALL) and
+					lengths[pc] == opcode_widths[opcode] + 1):
+					address = self.resolve_target(pc, self.branch_target(pc))
+					if address is None:
+						continue
+					i = bisect_right(relabelled, address) - 1
+					if i >= 0 and address - relabelled[i] <= distance:
+						regions.add(self.region_index(pc))
+		return regions
+
+
+json_record_encoder = json.JSONEncoder(separators=(',', ':'))
+
+class FlowGraph:
+	# the basic blocks of the traced code and the edges between them, in compressed
+	# sparse row arrays: the edges out of block i are offsets[i] to offsets[i + 1],
+	# and the edges into it are those listed from reverse_offsets[i] to
+	# reverse_offsets[i + 1] in reverse_edges
+
+	def __init__(self, disassembler):
+		raw_data, lengths, left_data = (disassembler.raw_data, disassembler.lengths,
+			disassembler.left_data)
+		size = disassembler.data_size
+		self.filename = disassembler.filename
+		self.labels = disassembler.labels
+
+		# the branches and the instructions that end a block, and the instructions right
+		# after data, found a whole ROM at a time
+		instructions = int.from_bytes(lengths.translate(nonzero_table), 'little')
+		terminators = array(UINT32_TYPECODE,
+			disassembler.opcode_addresses(opcode_ends_block))
+		starts = set(compress(range(size), (instructions & (int.from_bytes(left_data,
+			'little') << 8 | 1)).to_bytes(size, 'little')))
+		starts.update(start for start, _ in disassembler.regions() if start < size and
+			lengths[start])
+		starts.update(address for address in self.labels if address < size and lengths[address])
+		targets = {}
+		for pc in terminators:
+			length = lengths[pc]
+			if pc + length < size and lengths[pc + length]:
+				starts.add(pc + length)
+			opcode = raw_data[pc]
+			if opcode_branches[opcode] and length == 1 + opcode_widths[opcode]:
+				target = disassembler.resolve_target(pc, disassembler.branch_target(pc))
+				if target is not None and target < size and lengths[target]:
+					targets[pc] = target
+					starts.add(target)
+
+		self.starts = array(UINT32_TYPECODE, sorted(starts))
+		self.ends = array(UINT32_TYPECODE)
+		self.offsets = array(UINT32_TYPECODE, [0])
+		# the block each edge leads to, the instruction it leaves from, and its kind
+		self.targets = array(UINT32_TYPECODE)
+		self.sources = array(UINT32_TYPECODE)
+		self.kinds = bytearray()
+		blocks = {start: i for i, start in enumerate(self.starts)}
+		ends, offsets = self.ends, self.offsets
+		edge_targets, sources, kinds = self.targets, self.sources, self.kinds
+		flat = disassembler.is_flat()
+		# the terminators and the blocks are both in address order
+		k = 0
+		terminators.append(size)
+		for i, start in enumerate(self.starts):
+			next_start = self.starts[i + 1] if i + 1 < len(self.starts) else size
+			stop = next_start if flat else min(next_start, (start // BANK_SIZE + 1) * BANK_SIZE)
+			data = left_data.find(1, start, stop)
+			if data >= 0:
+				stop = data
+			while terminators[k] < start:
+				k += 1
+			pc = terminators[k]
+			if pc < stop:
+				end = pc + lengths[pc]
+				flow = opcode_flows[raw_data[pc]]
+				if pc in targets:
+					edge_targets.append(blocks[targets[pc]])
+					sources.append(pc)
+					kinds.append(EDGE_CALL if flow & FLOW_CALL else EDGE_JUMP)
+				if not flow & FLOW_END and end in blocks:
+					edge_targets.append(blocks[end])
+					sources.append(pc)
+					kinds.append(EDGE_NEXT)
+			else:
+				end = stop
+				if end == next_start and end in blocks:
+					edge_targets.append(blocks[end])
+					sources.append(disassembler.instruction_start(end - 1))
+					kinds.append(EDGE_NEXT)
+			ends.append(end)
+			offsets.append(len(edge_targets))
+
+		counts = [0] * (len(self.starts) + 1)
+		for target in self.targets:
+			counts[target + 1] += 1
+		self.reverse_offsets = array(UINT32_TYPECODE, accumulate(counts))
+		self.reverse_edges = array(UINT32_TYPECODE, bytes(len(self.targets) *
+			self.reverse_offsets.itemsize))
+		positions = list(self.reverse_offsets[:-1])
+		for edge, target in enumerate(self.targets):
+			self.reverse_edges[positions[target]] = edge
+			positions[target] += 1
+
+	def block(self, address):
+		# the index of the block that contains address, or None
+		i = bisect_right(self.starts, address) - 1
+		if i >= 0 and address < self.ends[i]:
+			return i
+		return None
+
+	def edges_out(self, address):
+		i = self.block(address)
+		return range(0, 0) if i is None else range(self.offsets[i], self.offsets[i + 1])
+
+	def edges_in(self, address):
+		i = self.block(address)
+		if i is None:
+			return []
+		return self.reverse_edges[self.reverse_offsets[i]:self.reverse_offsets[i + 1]]
+
+	def successors(self, address):
+		# (block, kind) for each edge out of the block containing address
+		return [(self.starts[self.targets[edge]], EDGE_KINDS[self.kinds[edge]])
+			for edge in self.edges_out(address)]
+
+	def predecessors(self, address):
+		# (instruction, kind) for each edge into the block containing address
+		return [(self.sources[edge], EDGE_KINDS[self.kinds[edge]])
+			for edge in self.edges_in(address)]
+
+	def callers(self, address):
+		# the calls to the routine at address
+		return sorted(self.sources[edge] for edge in self.edges_in(address)
+			if self.kinds[edge] == EDGE_CALL)
+
+	def callees(self, address):
+		# the routines called from the routine at address, following its jumps
+		routines = set()
+		for i in self.reachable_blocks(address, calls=False):
+			for edge in range(self.offsets[i], self.offsets[i + 1]):
+				if self.kinds[edge] == EDGE_CALL:
+					routines.add(self.starts[self.targets[edge]])
+		return sorted(routines)
+
+	def reachable(self, address, calls=True):
+		# the starts of the blocks that can run after the one containing address
+		return [self.starts[i] for i in self.reachable_blocks(address, calls)]
+
+	def reachable_blocks(self, address, calls=True):
+		i = self.block(address)
+		if i is None:
+			return []
+		seen = bytearray(len(self.starts))
+		seen[i] = 1
+		worklist = [i]
+		while worklist:
+			i = worklist.pop()
+			for edge in range(self.offsets[i], self.offsets[i + 1]):
+				target = self.targets[edge]
+				if not seen[target] and (calls or self.kinds[edge] != EDGE_CALL):
+					seen[target] = 1
+					worklist.append(target)
+		return list(compress(range(len(seen)), seen))
+
+	def block_label(self, i):
+		names = self.labels.get(self.starts[i])
+		return primary_label(names) if names else None
+
+	def as_dict(self):
+		return {
+			'blocks': [{'start': start, 'end': end, 'label': self.block_label(i)}
+				for i, (start, end) in enumerate(zip(self.starts, self.ends))],
+			'edges': [{'from': self.starts[i], 'to': self.starts[self.targets[edge]],
+				'address': self.sources[edge], 'kind': EDGE_KINDS[self.kinds[edge]]}
+				for i in range(len(self.starts))
+				for edge in range(self.offsets[i], self.offsets[i + 1])],
+		}
+
+	def write_dot(self, output):
+		output.write('digraph %s {\n\tnode [shape=box, fontname=monospace];\n' %
+			json.dumps(os.path.basename(self.filename or 'rom')))
+		for i, (start, end) in enumerate(zip(self.starts, self.ends)):
+			name = self.block_label(i)
+			output.write('\tn%06x [label=%s];\n' % (start, json.dumps('%s%s-%s' % (
+				name + '\n' if name else '', format_address(start), format_address(end - 1)))))
+		for i, start in enumerate(self.starts):
+			for edge in range(self.offsets[i], self.offsets[i + 1]):
+				output.write('\tn%06x -> n%06x%s;\n' % (start, self.starts[self.targets[edge]],
+					EDGE_DOT_ATTRIBUTES[self.kinds[edge]]))
+		output.write('}\n')
+
+	def write(self, filename):
+		# DOT for a .dot file, JSON otherwise
+		with open(filename, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+			if filename.endswith('.dot'):
+				self.write_dot(f)
+			else:
+				json.dump(self.as_dict(), f)
+
+
+class BankStore:
+	# traces of ROM regions in a directory, keyed by the contents of the region and the
+	# addresses it was entered at, so that ROMs sharing a bank trace it once
+
+	def __init__(self, directory):
+		self.directory = directory
+
+	def key(self, data, kind, entries):
+		key = hashlib.blake2b(digest_size=20)
+		key.update(b'%d %s %d\n' % (CACHE_VERSION, kind.encode('ascii'), len(data)))
+		key.update(data)
+		key.update(' '.join('%x' % entry for entry in sorted(entries)).encode('ascii'))
+		return key.hexdigest()
+
+	def filename(self, key):
+		return os.path.join(self.directory, key + '.gbdb')
+
+	def load(self, key, size):
+		# the lengths, coverage and branch targets of a region, or None
+		try:
+			with open(self.filename(key), 'rb') as f:
+				data = f.read()
+			magic, version, data_size, num_targets = BANK_HEADER.unpack_from(data)
+			if (magic, version, data_size) != (BANK_MAGIC, CACHE_VERSION, size):
+				return None
+			payload = zlib.decompress(data[BANK_HEADER.size:])
+		except (OSError, struct.error, zlib.error):
+			return None
+		targets = array('H')
+		targets.frombytes(payload[2 * size:2 * size + 2 * num_targets])
+		if sys.byteorder != 'little':
+			targets.byteswap()
+		return payload[:size], payload[size:2 * size], targets
+
+	def save(self, key, lengths, left_data, targets):
+		if sys.byteorder != 'little':
+			targets = array('H', targets)
+			targets.byteswap()
+		os.makedirs(self.directory, exist_ok=True)
+		write_atomically(self.filename(key), BANK_HEADER.pack(BANK_MAGIC, CACHE_VERSION,
+			len(lengths), len(targets)) + zlib.compress(b''.join([lengths, left_data,
+			targets.tobytes()]), 1))
+
+
+def encode_json_record(record):
+	if 'bytes' in record:
+		record['bytes'] = record['bytes'].hex()
+	return json_record_encoder.encode(record) + '\n'
+
+def encode_record(record):
+	strings = []
+	if record['type'] == 'instruction':
+		strings.append(record['mnemonic'])
+		strings.extend(record['operands'])
+	num_operands = len(strings)
+	strings.extend(record['labels'])
+	data = record.get('bytes', b'')
+	target = record.get('target')
+	strings = b''.join(RECORD_STRING_SIZE.pack(len(string)) + string
+		for string in (string.encode('utf-8') for string in strings))
+	return RECORD_HEADER.pack(RECORD_HEADER.size - 4 + len(data) + len(strings),
+		RECORD_TYPES.index(record['type']), record['address'],
+		-1 if target is None else target, len(data), num_operands,
+		len(record['labels'])) + data + strings
+
+
+def write_atomically(filename, data):
+	# concurrent runs never see a partial file
+	dirname = os.path.dirname(filename) or '.'
+	with tempfile.NamedTemporaryFile('wb', dir=dirname, delete=False) as f:
+		f.write(data)
+	os.replace(f.name, filename)
+
+
+def encode_labels(labels):
+	return '\n'.join('%x %s' % (address, name)
+		for address, names in labels.items() for name in names).encode('utf-8')
+
+def decode_labels(data):
+	labels = defaultdict(set)
+	for line in bytes(data).decode('utf-8').splitlines():
+		address, name = line.split(' ', 1)
+		labels[int(address, 16)].add(name)
+	return labels
+
+def encode_label_index(labels):
+	# sorted addresses, and the offsets of their newline-separated names
+	addresses = array(UINT32_TYPECODE, sorted(labels))
+	names = ['\n'.join(sorted(labels[address])).encode('utf-8') for address in addresses]
+	offsets = array(UINT32_TYPECODE, accumulate(map(len, names), initial=0))
+	return addresses, offsets, b''.join(names)
+
+def label_index_names(label_index, i):
+	_, offsets, names = label_index
+	return str(names[offsets[i]:offsets[i + 1]], 'utf-8').split('\n')
+
+
+_bank_worker = None
+
+def _init_bank_worker(rom, labels, ram_labels):
+	global _bank_worker
+	_bank_worker = Disassembler(rom)
+	_bank_worker.add_labels(labels, ram_labels)
+	_bank_worker.starting_points.clear()
+
+def _trace_bank_worker(bank, entries, left_data, lengths):
+	disassembler = _bank_worker
+	start = bank * BANK_SIZE
+	end = start + len(left_data)
+	disassembler.left_data[start:end] = left_data
+	disassembler.lengths[start:end] = lengths
+	disassembler.stats = Stats()
+	# a fresh worklist, as the order a reused set pops in would depend on the banks this
+	# worker happened to trace before
+	disassembler.starting_points = set(sorted(entries))
+	known_labels = set(disassembler.labels)
+	outgoing = disassembler.trace_bank(bank)
+	new_labels = disassembler.labels.keys() - known_labels
+	return (bank, bytes(disassembler.left_data[start:end]),
+		bytes(disassembler.lengths[start:end]), new_labels, outgoing, disassembler.stats)
+
+
+def signature_labels(disassembler, signatures, known=()):
+	labels = signatures.labels(disassembler.raw_data, known)
+	disassembler.stats.signature_matches += len(labels)
+	return labels
+
+
+_render_worker = None
+
+def _init_render_worker(rom, analysis, nearest_labels):
+	global _render_worker
+	_render_worker = Disassembler(rom)
+	_render_worker.decode_analysis(analysis)
+	_render_worker.nearest_labels = nearest_labels
+
+def _render_range_worker(start, end):
+	return render_text(_render_worker, start, end)
+
+def render_parallel(disassembler, ranges, jobs=None):
+	# the text of each (start, end) range, rendered in worker processes, in order
+	rom = disassembler.filename or bytes(disassembler.raw_data)
+	# enough tasks in flight to keep the workers busy, without holding the whole listing
+	max_pending = 2 * (jobs or os.cpu_count() or 1)
+	with ProcessPoolExecutor(jobs, initializer=_init_render_worker,
+		initargs=(rom, disassembler.encode_analysis(), disassembler.nearest_labels)) as executor:
+		pending = deque()
+		for start, end in ranges:
+			pending.append(executor.submit(_render_range_worker, start, end))
+			if len(pending) > max_pending:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+
+
+def trace_mode(disassembler, jobs=1, bank_store=None):
+	# how analyse() traces the ROM
+	if bank_store:
+		return 'shared'
+	if jobs == 1 or disassembler.is_flat():
+		return 'serial'
+	return 'parallel'
+
+def analyse(disassembler, entry_point=0x000000, sym_filename=None, jobs=1, tables=False,
+	signatures=None, bank_store=None):
+	if sym_filename:
+		with disassembler.stats.phase('symfile'):
+			disassembler.add_labels(*parse_symfile(sym_filename))
+	if signatures:
+		with disassembler.stats.phase('signatures'):
+			disassembler.add_labels(signature_labels(disassembler, signatures,
+				disassembler.labels))
+	disassembler.labels[entry_point].add('ENTRY_POINT')
+	with disassembler.stats.phase('trace'):
+		mode = trace_mode(disassembler, jobs, bank_store)
+		if mode == 'shared':
+			disassembler.trace_shared(bank_store, entry_point)
+		elif mode == 'serial':
+			disassembler.trace(entry_point)
+		else:
+			disassembler.trace_parallel(entry_point, jobs)
+	if tables:
+		with disassembler.stats.phase('tables'):
+			disassembler.trace_tables()
+
+
+def prepare_disassembler(filename, entry_point=0x000000, sym_filename=None, jobs=1,
+	cache_dir=None, window=None, nearest_labels=False, tables=False, signatures=None,
+	bank_store=None):
+	# an analysed Disassembler, or with a window, one that can at least render it
+	disassembler = Disassembler(filename)
+	disassembler.nearest_labels = nearest_labels
+	stats = disassembler.stats
+	start, end = window or (0, None)
+	if end is None:
+		end = disassembler.data_size
+
+	cached = False
+	cache_filename = window_filename = None
+	if cache_dir:
+		key = analysis_key(disassembler.raw_data, entry_point, sym_filename, tables,
+			signatures, trace_mode(disassembler, jobs, bank_store))
+		cache_filename = os.path.join(cache_dir, key + '.gbda')
+		if window:
+			window_filename = os.path.join(cache_dir, key + '.gbdw')
+		with stats.phase('cache'):
+			if window_filename and disassembler.load_window(window_filename, start, end):
+				cached, cache_filename, window_filename = True, None, None
+			else:
+				cached = disassembler.load_analysis(cache_filename)
+
+	if not cached:
+		analyse(disassembler, entry_point, sym_filename, jobs, tables, signatures, bank_store)
+	if cache_filename:
+		with stats.phase('cache'):
+			os.makedirs(cache_dir, exist_ok=True)
+			if not cached:
+				disassembler.save_analysis(cache_filename)
+			if window_filename:
+				disassembler.save_window_index(window_filename)
+	return disassembler
+
+def disassemble(filename, entry_point=0x000000, sym_filename=None, jobs=1, output=None,
+	cache_dir=None, window=None, nearest_labels=False, output_format='asm', tables=False,
+	signatures=None, bank_store=None, render_jobs=1):
+	# window is an optional (start, end) range of ROM addresses to render; jobs trace the
+	# banks in parallel, and render_jobs render the listing in parallel
+	disassembler = prepare_disassembler(filename, entry_point, sym_filename, jobs, cache_dir,
+		window, nearest_labels, tables, signatures, bank_store)
+	with disassembler.stats.phase('render'):
+		if output_format == 'asm':
+			disassembler.write_parallel(output or sys.stdout, render_jobs, *(window or ()))
+		else:
+			if not output:
+				output = sys.stdout.buffer if output_format == 'binary' else sys.stdout
+			disassembler.write_records(output, output_format, *(window or ()))
+	return disassembler
+
+
+def diff_routines(base_routines, routines):
+	# (base routine, routine) pairs for each routine that differs, with None for the
+	# routines in only one ROM, and the number of routines that are the same
+	unmatched = defaultdict(deque)
+	for routine in base_routines:
+		unmatched[routine[3]].append(routine)
+	added = []
+	unchanged = 0
+	for routine in routines:
+		if unmatched.get(routine[3]):
+			unmatched[routine[3]].popleft()
+			unchanged += 1
+		else:
+			added.append(routine)
+	removed = sorted(routine for queue in unmatched.values() for routine in queue)
+
+	# what is left is modified if a routine has the same name or address in both ROMs
+	by_name = {routine[2]: routine for routine in removed}
+	by_address = {routine[0]: routine for routine in removed}
+	changes = []
+	for routine in added:
+		base = by_name.pop(routine[2], None) or by_address.pop(routine[0], None)
+		if base:
+			by_name.pop(base[2], None)
+			by_address.pop(base[0], None)
+		changes.append((base, routine))
+	changes.extend((routine, None) for routine in removed if routine[0] in by_address)
+	return changes, unchanged
+
+def side_by_side(base_lines, lines):
+	# sdiff-style rows, comparing lines without their addresses and bytes: | for lines
+	# that changed, and < or > for lines in only one of them
+	base_lines = [line.expandtabs() for line in base_lines]
+	lines = [line.expandtabs() for line in lines]
+	width = max(map(len, base_lines), default=0)
+	matcher = difflib.SequenceMatcher(None, [line.partition(';')[0].rstrip()
+		for line in base_lines], [line.partition(';')[0].rstrip() for line in lines],
+		autojunk=False)
+	for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+		for left, right in zip_longest(base_lines[i1:i2], lines[j1:j2]):
+			marker = ' ' if tag == 'equal' else '>' if left is None else '<' if right is None \
+				else '|'
+			yield ('%-*s %s %s' % (width, left or '', marker, right or '')).rstrip()
+
+def write_diff(base, disassembler, output, changes, unchanged):
+	num_added = sum(base_routine is None for base_routine, _ in changes)
+	num_removed = sum(routine is None for _, routine in changes)
+	output.write('; %d modified, %d added, %d removed, %d unchanged\n' % (
+		len(changes) - num_added - num_removed, num_added, num_removed, unchanged))
+	for base_routine, routine in changes:
+		if base_routine and routine:
+			output.write('\n; modified %s: %s -> %s\n' % (routine[2],
+				format_address(base_routine[0]), format_address(routine[0])))
+		elif routine:
+			output.write('\n; added %s: %s\n' % (routine[2], format_address(routine[0])))
+		else:
+			output.write('\n; removed %s: %s\n' % (base_routine[2],
+				format_address(base_routine[0])))
+		base_lines = list(base.render(*base_routine[:2])) if base_routine else []
+		lines = list(disassembler.render(*routine[:2])) if routine else []
+		output.writelines(row + '\n' for row in side_by_side(base_lines, lines))
+
+def disassemble_diff(base_filename, base_sym_filename, filename, entry_point=0x000000,
+	sym_filename=None, jobs=1, output=None, cache_dir=None, nearest_labels=False,
+	tables=False, signatures=None, bank_store=None):
+	# trace both ROMs, and write only the routines that were added, removed or modified
+	base = prepare_disassembler(base_filename, entry_point, base_sym_filename, jobs,
+		cache_dir, None, nearest_labels, tables, signatures, bank_store)
+	disassembler = prepare_disassembler(filename, entry_point, sym_filename, jobs,
+		cache_dir, None, nearest_labels, tables, signatures, bank_store)
+	with disassembler.stats.phase('diff'):
+		changes, unchanged = diff_routines(base.routines(), disassembler.routines())
+	with disassembler.stats.phase('render'):
+		if isinstance(output, str):
+			with open(output, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+				write_diff(base, disassembler, f, changes, unchanged)
+		else:
+			write_diff(base, disassembler, output or sys.stdout, changes, unchanged)
+	return disassembler
+
+
+def save_incremental_state(filename, key, analysis, checksums, texts):
+	texts = [text.encode('utf-8') for text in texts]
+	sizes = array(UINT32_TYPECODE, map(len, texts))
+	if sys.byteorder != 'little':
+		checksums = array(UINT32_TYPECODE, checksums)
+		checksums.byteswap()
+		sizes.byteswap()
+	header = INCREMENTAL_HEADER.pack(INCREMENTAL_MAGIC, CACHE_VERSION, key, len(analysis),
+		len(checksums), len(texts))
+	write_atomically(filename, b''.join([header, analysis, checksums.tobytes(),
+		sizes.tobytes()] + texts))
+
+def load_incremental_state(filename):
+	try:
+		with open(filename, 'rb') as f:
+			data = f.read()
+		(magic, version, key, analysis_size, num_checksums,
+			num_texts) = INCREMENTAL_HEADER.unpack_from(data)
+		if (magic, version) != (INCREMENTAL_MAGIC, CACHE_VERSION):
+			return None
+		end = INCREMENTAL_HEADER.size + analysis_size
+		analysis = data[INCREMENTAL_HEADER.size:end]
+		payload = memoryview(data)[end:]
+	except (OSError, struct.error):
+		return None
+
+	checksums = array(UINT32_TYPECODE)
+	sizes = array(UINT32_TYPECODE)
+	end = num_checksums * checksums.itemsize
+	checksums.frombytes(payload[:end])
+	sizes.frombytes(payload[end:end + num_texts * sizes.itemsize])
+	end += num_texts * sizes.itemsize
+	if sys.byteorder != 'little':
+		checksums.byteswap()
+		sizes.byteswap()
+	texts = []
+	for size in sizes:
+		texts.append(str(payload[end:end + size], 'utf-8'))
+		end += size
+	return key, analysis, checksums, texts
+
+
+def render_text(disassembler, start, end):
+	lines = list(disassembler.render(start, end))
+	return '\n'.join(lines) + '\n' if lines else ''
+
+def render_regions(disassembler, regions=None, jobs=1):
+	all_regions = disassembler.regions()
+	texts = [None] * len(all_regions)
+	indexes = [index for index in range(len(texts)) if regions is None or index in regions]
+	ranges = [all_regions[index] for index in indexes]
+	if jobs == 1 or len(ranges) < 2:
+		rendered = (render_text(disassembler, start, end) for start, end in ranges)
+	else:
+		rendered = render_parallel(disassembler, ranges, jobs)
+	for index, text in zip(indexes, rendered):
+		texts[index] = text
+	return texts
+
+
+def disassemble_incremental(filename, entry_point=0x000000, sym_filename=None, jobs=1,
+	output=None, cache_dir='.', nearest_labels=False, signatures=None, decode=False,
+	render_jobs=1):
+	# reuse the previous analysis and listing of the same files, re-tracing and
+	# re-rendering only what the changes since then affect; an unchanged listing is
+	# written without decoding its analysis unless decode is set, e.g. for --stats
+	disassembler = Disassembler(filename)
+	disassembler.nearest_labels = nearest_labels
+	stats = disassembler.stats
+	# -j keeps a state of its own, as its full analyses can differ from serial ones
+	mode = trace_mode(disassembler, jobs)
+	key = bytes.fromhex(analysis_key(disassembler.raw_data, entry_point, sym_filename,
+		signatures=signatures, mode=mode))
+	state_filename = os.path.join(cache_dir,
+		source_key(filename, entry_point, sym_filename, nearest_labels, mode) + '.gbdi')
+	with stats.phase('cache'):
+		state = load_incremental_state(state_filename)
+		checksums = block_checksums(disassembler.raw_data)
+
+	if state and state[0] == key and (not decode or disassembler.decode_analysis(state[1])):
+		texts = state[3]
+	elif state and disassembler.decode_analysis(state[1]) and len(state[3]) == len(
+		disassembler.regions()):
+		_, _, old_checksums, texts = state
+		lengths = bytes(disassembler.lengths)
+		labels, ram_labels = disassembler.labels, disassembler.ram_labels
+		changed = changed_ranges(old_checksums, checksums, disassembler.data_size)
+		with stats.phase('symfile'):
+			sym_labels = parse_symfile(sym_filename) if sym_filename else ({}, {})
+		if signatures:
+			with stats.phase('signatures'):
+				sym_labels[0].update(signature_labels(disassembler, signatures, sym_labels[0]))
+		with stats.phase('trace'):
+			disassembler.retrace(changed, *sym_labels, entry_point)
+			regions = disassembler.changed_regions(changed, lengths, labels, ram_labels)
+		with stats.phase('render'):
+			for index, text in enumerate(render_regions(disassembler, regions,
+				render_jobs)):
+				if text is not None:
+					texts[index] = text
+	else:
+		disassembler = Disassembler(filename)
+		disassembler.nearest_labels = nearest_labels
+		disassembler.stats = stats
+		analyse(disassembler, entry_point, sym_filename, jobs, signatures=signatures)
+		with stats.phase('render'):
+			texts = render_regions(disassembler, jobs=render_jobs)
+
+	if not state or state[0] != key:
+		with stats.phase('cache'):
+			os.makedirs(cache_dir, exist_ok=True)
+			save_incremental_state(state_filename, key, disassembler.encode_analysis(),
+				checksums, texts)
+
+	output = output or sys.stdout
+	with stats.phase('render'):
+		if isinstance(output, str):
+			with open(output, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+				f.writelines(texts)
+		else:
+			output.writelines(texts)
+	return disassembler
+
+
+def split_filenames(filenames):
+	# a.bin [a.sym] [entry_point]
+	bin_filename, sym_filename, entry_point = filenames[0], None, 0x000000
+	if len(filenames) == 3:
+		sym_filename = filenames[1]
+		entry_point = int(filenames[2], 16)
+	elif len(filenames) == 2:
+		if set(filenames[1].lower()) - set('0123456789abcdef'):
+			sym_filename = filenames[1]
+		else:
+			entry_point = int(filenames[1], 16)
+	elif len(filenames) != 1:
+		raise ValueError('too many arguments')
+	return bin_filename, sym_filename, entry_point
+
+def find_roms(path):
+	# ROM, sym file, entry point and listing name for each ROM in a directory or manifest
+	if os.path.isdir(path):
+		for root, dirs, files in os.walk(path):
+			dirs.sort()
+			roms = [name for name in sorted(files)
+				if os.path.splitext(name)[1].lower() in ROM_EXTENSIONS]
+			stems = defaultdict(int)
+			for name in roms:
+				stems[os.path.splitext(name)[0]] += 1
+			for name in roms:
+				stem = os.path.splitext(name)[0]
+				# ROMs that share a stem, e.g. a.gb and a.gbc, keep their extension in the
+				# listing name, and use a sym file named after the whole file if there is one
+				listing, sym_names = stem, [stem + '.sym']
+				if stems[stem] > 1:
+					listing, sym_names = name, [name + '.sym', stem + '.sym']
+				sym_filename = next((os.path.join(root, sym_name) for sym_name in sym_names
+					if os.path.isfile(os.path.join(root, sym_name))), None)
+				yield (os.path.join(root, name), sym_filename, 0x000000,
+					os.path.relpath(os.path.join(root, listing), path))
+		return
+
+	# a manifest has one 'a.bin [a.sym] [entry_point]' per line, relative to itself
+	base = os.path.dirname(path)
+	with open(path, 'r') as f:
+		for number, line in enumerate(f, 1):
+			line = line.split('#')[0].strip()
+			if not line:
+				continue
+			try:
+				bin_filename, sym_filename, entry_point = split_filenames(line.split())
+			except ValueError as e:
+				raise ValueError('%s:%d: %s' % (path, number, e))
+			bin_filename = os.path.join(base, bin_filename)
+			if sym_filename:
+				sym_filename = os.path.join(base, sym_filename)
+			yield (bin_filename, sym_filename, entry_point,
+				os.path.relpath(os.path.splitext(bin_filename)[0], base))
+
+def _init_batch_worker(memory_limit):
+	if memory_limit:
+		import resource
+		resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+def _disassemble_batch_job(bin_filename, sym_filename, entry_point, output, cache_dir,
+	incremental, nearest_labels, output_format, tables, signatures, bank_store):
+	result = {'rom': bin_filename, 'sym': sym_filename, 'output': output}
+	start = time.perf_counter()
+	try:
+		os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+		if incremental:
+			disassembler = disassemble_incremental(bin_filename, entry_point, sym_filename,
+				1, output, cache_dir, nearest_labels, signatures, decode=True)
+		else:
+			disassembler = disassemble(bin_filename, entry_point, sym_filename, 1, output,
+				cache_dir, None, nearest_labels, output_format, tables, signatures, bank_store)
+		result['stats'] = disassembler.stats.as_dict(disassembler)
+	except Exception as e:
+		result['error'] = '%s: %s' % (type(e).__name__, e)
+		# do not leave a partial listing behind
+		if os.path.isfile(output):
+			os.remove(output)
+	result['time'] = time.perf_counter() - start
+	return result
+
+def disassemble_batch(paths, jobs=None, output_dir=None, cache_dir=None, incremental=False,
+	memory_limit=None, log=None, nearest_labels=False, output_format='asm', tables=False,
+	signatures=None, bank_store=None):
+	# disassemble every ROM in the given directories and manifests on a process pool,
+	# returning the time taken or the error for each ROM
+	batch = []
+	for path in paths:
+		for bin_filename, sym_filename, entry_point, name in find_roms(path):
+			extension = OUTPUT_FORMATS[output_format]
+			if output_dir:
+				output = os.path.join(output_dir, name + extension)
+			else:
+				output = os.path.join(os.path.dirname(bin_filename),
+					os.path.basename(name) + extension)
+			batch.append((bin_filename, sym_filename, entry_point, output))
+
+	# a listing that two ROMs would both write fails for the later ROM
+	results = [None] * len(batch)
+	outputs = {}
+	for index, (bin_filename, sym_filename, _, output) in enumerate(batch):
+		key = os.path.normcase(os.path.abspath(output))
+		if key not in outputs:
+			outputs[key] = bin_filename
+			continue
+		results[index] = {'rom': bin_filename, 'sym': sym_filename, 'output': output,
+			'error': 'ValueError: %s is also the listing of %s' % (output, outputs[key]),
+			'time': None}
+		if log:
+			print('  FAILED  %s: %s' % (bin_filename, results[index]['error']), file=log)
+
+	options = {}
+	if sys.version_info >= (3, 11):
+		options['max_tasks_per_child'] = BATCH_TASKS_PER_CHILD
+	with ProcessPoolExecutor(jobs, initializer=_init_batch_worker, initargs=(memory_limit,),
+		**options) as executor:
+		futures = {executor.submit(_disassemble_batch_job, *job, cache_dir, incremental,
+			nearest_labels, output_format, tables, signatures, bank_store): index
+			for index, job in enumerate(batch) if results[index] is None}
+		for future in as_completed(futures):
+			index = futures[future]
+			try:
+				result = future.result()
+			except Exception as e:
+				# the worker died, e.g. killed for running out of memory
+				bin_filename, sym_filename, _, output = batch[index]
+				result = {'rom': bin_filename, 'sym': sym_filename, 'output': output,
+					'error': '%s: %s' % (type(e).__name__, e), 'time': None}
+			results[index] = result
+			if log:
+				if 'error' in result:
+					print('  FAILED  %s: %s' % (result['rom'], result['error']), file=log)
+				else:
+					print('%8.3fs  %s' % (result['time'], result['rom']), file=log)
+	return results
+
+
+class Server:
+	# keeps analysed ROMs in memory and answers queries about them over a Unix socket,
+	# one JSON request per line, each answered by a JSON response line and 'size'
+	# bytes of listing
+
+	def __init__(self, max_roms=SERVER_MAX_ROMS, jobs=1, cache_dir=None):
+		self.max_roms = max_roms
+		self.jobs = jobs
+		self.cache_dir = cache_dir
+		# least recently used first
+		self.disassemblers = OrderedDict()
+
+	def disassembler(self, request):
+		filename = os.path.realpath(request['rom'])
+		sym_filename = request.get('sym') and os.path.realpath(request['sym'])
+		entry_point = request.get('entry_point', 0x000000)
+		key = (filename, sym_filename, entry_point)
+		# reload ROMs and sym files that have changed since
+		version = [(stat.st_size, stat.st_mtime_ns) for stat in
+			map(os.stat, filter(None, [filename, sym_filename]))]
+
+		entry = self.disassemblers.pop(key, None)
+		if entry is None or entry[0] != version:
+			disassembler = prepare_disassembler(filename, entry_point, sym_filename, self.jobs,
+				self.cache_dir)
+			entry = (version, disassembler)
+		self.disassemblers[key] = entry
+		while len(self.disassemblers) > self.max_roms:
+			self.disassemblers.popitem(last=False)
+		return entry[1]
+
+	def handle(self, request):
+		command = request.get('command', 'render')
+		if command == 'status':
+			return {'roms': [{'rom': filename, 'sym': sym_filename, 'entry_point': entry_point,
+				'instructions': disassembler.num_instructions()}
+				for (filename, sym_filename, entry_point), (_, disassembler)
+				in self.disassemblers.items()]}, ''
+
+		disassembler = self.disassembler(request)
+		disassembler.nearest_labels = request.get('nearest_labels', False)
+		if command == 'render':
+			start, end = request.get('start', 0), request.get('end')
+			lines = disassembler.render(disassembler.line_start(start), end)
+			return {}, ''.join(line + '\n' for line in lines)
+		if command == 'label':
+			address = request['address']
+			return {'labels': sorted(disassembler.labels.get(address, ()))}, ''
+		if command == 'trace':
+			address = request['address']
+			if not 0 <= address < disassembler.data_size:
+				raise ValueError('address out of range: %x' % address)
+			num_instructions = disassembler.num_instructions()
+			if address not in disassembler.labels:
+				disassembler.labels[address].add(format_label(address))
+			disassembler.trace(address)
+			return {'instructions': disassembler.num_instructions() - num_instructions}, ''
+		if command in ('callers', 'callees'):
+			graph = disassembler.flow_graph()
+			return {command: getattr(graph, command)(request['address'])}, ''
+		raise ValueError('unknown command: %s' % command)
+
+	async def handle_connection(self, reader, writer):
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				try:
+					response, text = self.handle(json.loads(line))
+				except Exception as e:
+					response, text = {'error': '%s: %s' % (type(e).__name__, e)}, ''
+				data = text.encode('utf-8')
+				response['size'] = len(data)
+				writer.write(json.dumps(response).encode('utf-8') + b'\n' + data)
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def run(self, path):
+		import asyncio
+		import signal
+		server = await asyncio.start_unix_server(self.handle_connection, path)
+		loop = asyncio.get_running_loop()
+		for signum in (signal.SIGINT, signal.SIGTERM):
+			loop.add_signal_handler(signum, server.close)
+		async with server:
+			try:
+				await server.serve_forever()
+			except asyncio.CancelledError:
+				pass
+
+	def serve(self, path):
+		import asyncio
+		if os.path.lexists(path):
+			if not is_socket(path):
+				raise RuntimeError('%s exists and is not a socket' % path)
+			try:
+				query_server(path, {'command': 'status'})
+				raise RuntimeError('a server is already listening on %s' % path)
+			except ConnectionRefusedError:
+				# left behind by a server that did not shut down cleanly
+				os.remove(path)
+		try:
+			asyncio.run(self.run(path))
+		finally:
+			if is_socket(path):
+				os.remove(path)
+
+def is_socket(path):
+	try:
+		return S_ISSOCK(os.lstat(path).st_mode)
+	except OSError:
+		return False
+
+def query_server(path, request):
+	import socket
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.connect(path)
+		sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+		with sock.makefile('rb') as f:
+			response = json.loads(f.readline())
+			text = str(f.read(response.pop('size')), 'utf-8')
+	if 'error' in response:
+		raise RuntimeError(response['error'])
+	return response, text
+
+
+def format_hardware_register(a):
+	return gbhw_register_table.get(a, '$ff00+' + u8(a))
 
 gbhw_register_table = {
 	0x00: 'rJOYP',     # Joypad (R/W)
@@ -548,38 +2617,228 @@ gbhw_register_table = {
 }
 
 
-def usage_exit():
-	print('Usage: %s a.bin [a.sym] [entry_point]' % sys.argv[0], file=sys.stderr)
-	sys.exit(1)
+def parse_range(text):
+	start, separator, end = text.partition(':')
+	if not separator:
+		raise argparse.ArgumentTypeError('expected START:END')
+	try:
+		return int(start or '0', 16), int(end, 16) if end else None
+	except ValueError:
+		raise argparse.ArgumentTypeError('invalid address range: %s' % text)
 
-def main():
-	global starting_points, labels
-
-	argc = len(sys.argv)
-	if argc < 2:
-		usage_exit()
-	bin_filename = sys.argv[1]
-	sym_filename = None
-	entry_point = 0x000000
-	if argc == 4:
-		sym_filename = sys.argv[2]
-		entry_point = int(sys.argv[3], 16)
-	elif argc == 3:
-		if set(sys.argv[2].lower()) - set('0123456789abcdef'):
-			sym_filename = sys.argv[2]
-		else:
-			entry_point = int(sys.argv[2], 16)
-	elif argc != 2:
-		usage_exit()
+def parse_rom(text):
+	bin_filename, _, sym_filename = text.partition(':')
+	return bin_filename, sym_filename or None
 
-	if sym_filename:
-		sym_labels = parse_symfile(sym_filename)
-		labels.update(sym_labels)
-		starting_points.update(sym_labels.keys())
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(usage='%(prog)s [options] a.bin [a.sym] [entry_point]\n'
+		'       %(prog)s [options] -b DIR|MANIFEST...', description=__doc__.strip())
+	parser.add_argument('filenames', nargs='*', help=argparse.SUPPRESS)
+	parser.add_argument('-o', '--output', metavar='a.asm',
+		help='write the disassembly to this file instead of standard output '
+			'(with --batch, to this directory instead of next to each ROM)')
+	parser.add_argument('-b', '--batch', action='store_true',
+		help='disassemble every ROM in these directories or manifests of '
+			'"a.bin [a.sym] [entry_point]" lines, pairing each ROM with its sym file')
+	parser.add_argument('-c', '--cache', metavar='DIR',
+		help='reuse analyses saved in this directory for unchanged ROM and sym files')
+	parser.add_argument('-i', '--incremental', action='store_true',
+		help='update the previous analysis and listing of the same files in the cache '
+			'directory, re-tracing and re-rendering only what changed')
+	parser.add_argument('-j', '--jobs', type=int,
+		help='trace ROM banks, and unless --render-jobs is given render the listing, in '
+			'this many worker processes (0 for one per CPU), or with --batch, disassemble '
+			'this many ROMs at once (default one per CPU)')
+	parser.add_argument('--render-jobs', type=int, metavar='JOBS',
+		help='render the listing in this many worker processes (0 for one per CPU), into '
+			'the same text as a serial render; without --jobs, the trace stays serial '
+			'(default the same as --jobs)')
+	parser.add_argument('--share-banks', action='store_true',
+		help='with --cache, trace each ROM bank once for all the ROMs that contain it, '
+			'keeping the traces in the banks directory of the cache')
+	parser.add_argument('--memory-limit', type=int, metavar='MB',
+		help='with --batch, limit the address space of each worker to this many megabytes')
+	parser.add_argument('-r', '--range', type=parse_range, metavar='START:END',
+		help='only disassemble the hexadecimal ROM addresses from START up to END; '
+			'with --cache, later ranges of the same files are read from an index')
+	parser.add_argument('-f', '--format', choices=list(OUTPUT_FORMATS), default='asm',
+		help='write rgbds assembly (the default), one JSON record per line, or binary '
+			'records for each instruction and run of data')
+	parser.add_argument('-n', '--nearest-labels', action='store_true',
+		help='write branch targets without a sym file label relative to the nearest one '
+			'before them, e.g. Foo+$10')
+	parser.add_argument('-t', '--tables', action='store_true',
+		help='also trace the code that pointer tables among the undecoded bytes point at')
+	parser.add_argument('-s', '--signatures', action='append', metavar='FILE',
+		help='label the routines that match the byte signatures in this file, one '
+			'"Name 2a 12 ?? ..." per line with ?? for bytes that can differ (can be repeated)')
+	parser.add_argument('-d', '--diff', type=parse_rom, metavar='BASE.bin[:BASE.sym]',
+		help='only write the routines that were added, removed or modified since this ROM, '
+			'side by side')
+	parser.add_argument('-g', '--graph', metavar='a.dot|a.json',
+		help='save the basic blocks and the jumps and calls between them, as DOT for a .dot '
+			'file, or as JSON')
+	parser.add_argument('--serve', metavar='SOCKET',
+		help='keep ROMs loaded and answer queries on this Unix socket')
+	parser.add_argument('--max-roms', type=int, default=SERVER_MAX_ROMS,
+		help='with --serve, keep at most this many ROMs loaded (default %d)' % SERVER_MAX_ROMS)
+	parser.add_argument('--server', metavar='SOCKET',
+		default=os.environ.get(SERVER_ENVIRONMENT_VARIABLE),
+		help='ask the server on this Unix socket for the disassembly, falling back to '
+			'disassembling here if none is listening (default $%s)' %
+			SERVER_ENVIRONMENT_VARIABLE)
+	parser.add_argument('--conflicts', action='store_true',
+		help='list instructions that overlap and labels inside instructions on standard error')
+	parser.add_argument('--stats', action='store_true',
+		help='report timings and counts for each phase to standard error')
+	parser.add_argument('--stats-json', metavar='stats.json',
+		help='save the timings and counts as JSON')
+	parser.add_argument('--profile', metavar='a.prof',
+		help='save a cProfile dump of the run, for pstats or snakeviz')
+	args = parser.parse_args(argv)
+
+	if args.signatures:
+		try:
+			args.signatures = SignatureLibrary(args.signatures)
+		except (OSError, ValueError) as e:
+			parser.error(str(e))
+	if args.serve:
+		if args.jobs is None:
+			args.jobs = 1
+		return args
+	if not args.filenames:
+		parser.error('the following arguments are required: a.bin')
+	if not args.batch:
+		try:
+			args.bin_filename, args.sym_filename, args.entry_point = split_filenames(
+				args.filenames)
+		except ValueError as e:
+			parser.error(str(e))
+	if args.jobs is None:
+		args.jobs = 0 if args.batch else 1
+	if args.jobs < 0:
+		parser.error('--jobs must not be negative')
+	if args.render_jobs is None:
+		args.render_jobs = 1 if args.batch else args.jobs
+	if args.render_jobs < 0:
+		parser.error('--render-jobs must not be negative')
+	if args.render_jobs != 1 and args.batch:
+		parser.error('--render-jobs cannot be used with --batch')
+	if args.incremental and not args.cache:
+		parser.error('--incremental requires --cache')
+	if args.range and (args.batch or args.incremental):
+		parser.error('--range cannot be used with --batch or --incremental')
+	if args.diff and (args.batch or args.incremental or args.range or args.format != 'asm'):
+		parser.error('--diff cannot be used with --batch, --incremental, --range or --format')
+	if args.graph and (args.batch or args.incremental or args.range or args.diff):
+		parser.error('--graph cannot be used with --batch, --incremental, --range or --diff')
+	args.bank_store = None
+	if args.share_banks:
+		if not args.cache or args.incremental:
+			parser.error('--share-banks requires --cache, and cannot be used with --incremental')
+		args.bank_store = BankStore(os.path.join(args.cache, 'banks'))
+	if args.tables and args.incremental:
+		parser.error('--tables cannot be used with --incremental')
+	if args.format != 'asm' and args.incremental:
+		parser.error('--incremental only writes the asm format')
+	return args
 
-	labels[entry_point].add('ENTRY_POINT')
+def run(args):
+	if args.diff:
+		return disassemble_diff(*args.diff, args.bin_filename, args.entry_point,
+			args.sym_filename, args.jobs or None, args.output, args.cache, args.nearest_labels,
+			args.tables, args.signatures, args.bank_store)
+	if args.incremental:
+		return disassemble_incremental(args.bin_filename, args.entry_point,
+			args.sym_filename, args.jobs or None, args.output, args.cache, args.nearest_labels,
+			args.signatures, bool(args.stats or args.stats_json or args.conflicts),
+			args.render_jobs or None)
+	return disassemble(args.bin_filename, args.entry_point, args.sym_filename,
+		args.jobs or None, args.output, args.cache, args.range, args.nearest_labels,
+		args.format, args.tables, args.signatures, args.bank_store, args.render_jobs or None)
 
-	disassemble(sys.argv[1], entry_point)
+def run_batch(args):
+	start = time.perf_counter()
+	memory_limit = args.memory_limit and args.memory_limit << 20
+	results = disassemble_batch(args.filenames, args.jobs or None, args.output, args.cache,
+		args.incremental, memory_limit, sys.stderr, args.nearest_labels, args.format,
+		args.tables, args.signatures, args.bank_store)
+	elapsed = time.perf_counter() - start
+	failed = sum('error' in result for result in results)
+	print('%d ROMs, %d failed, %.3fs' % (len(results), failed, elapsed), file=sys.stderr)
+	if args.stats_json:
+		with open(args.stats_json, 'w') as f:
+			json.dump({'time': elapsed, 'results': results}, f, indent='\t')
+	return failed
+
+def report_conflicts(disassembler, file=None):
+	file = file or sys.stderr
+	overlaps, misaligned = disassembler.conflicts()
+	for address, pc in overlaps:
+		print('%s: instruction at %s begins inside the instruction at %s' % (
+			disassembler.filename, format_address(address), format_address(pc)), file=file)
+	for address, pc in misaligned:
+		print('%s: %s at %s is inside the instruction at %s' % (disassembler.filename,
+			primary_label(disassembler.labels[address]), format_address(address),
+			format_address(pc)), file=file)
+
+def run_client(args):
+	# write the listing from a server, if one is listening
+	request = {'command': 'render', 'rom': os.path.abspath(args.bin_filename),
+		'sym': args.sym_filename and os.path.abspath(args.sym_filename),
+		'entry_point': args.entry_point, 'nearest_labels': args.nearest_labels}
+	if args.range:
+		request['start'], request['end'] = args.range
+	try:
+		_, text = query_server(args.server, request)
+	except (FileNotFoundError, ConnectionRefusedError):
+		return False
+	if args.output:
+		with open(args.output, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+			f.write(text)
+	else:
+		sys.stdout.write(text)
+		sys.stdout.flush()
+	return True
+
+def main():
+	args = parse_args()
+	if args.batch:
+		sys.exit(1 if run_batch(args) else 0)
+	try:
+		if args.serve:
+			Server(args.max_roms, args.jobs or None, args.cache).serve(args.serve)
+			return
+		if args.server and args.format == 'asm' and not (args.incremental or args.diff or
+			args.tables or args.signatures or args.graph or args.stats or args.stats_json or
+			args.profile or args.conflicts) and run_client(args):
+			return
+		if args.profile:
+			import cProfile
+			profile = cProfile.Profile()
+			disassembler = profile.runcall(run, args)
+			profile.dump_stats(args.profile)
+		else:
+			disassembler = run(args)
+		sys.stdout.flush()
+		stats = disassembler.stats
+		if args.conflicts:
+			report_conflicts(disassembler)
+		if args.graph:
+			with stats.phase('graph'):
+				disassembler.flow_graph().write(args.graph)
+		if args.stats:
+			stats.report(disassembler)
+		if args.stats_json:
+			with open(args.stats_json, 'w') as f:
+				json.dump(stats.as_dict(disassembler), f, indent='\t')
+	except BrokenPipeError:
+		# the reader went away, e.g. when piped into head
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		sys.exit(1)
+	except RuntimeError as e:
+		# from the server
+		sys.exit('%s: error: %s' % (os.path.basename(sys.argv[0]), e))
 
 if __name__ == '__main__':
 	main()